@@ -0,0 +1,6 @@
+"""
+Helper modules for the Phase 2 pipeline (new_preprocess.ipynb and friends).
+
+The notebooks run from the repo root, so `from cbs_pipeline import stitch` works
+without installing anything.
+"""
@@ -0,0 +1,113 @@
+"""
+Date-window blocking for candidate generation.
+
+final_project_functions.py defines upwindow = 7 and lowwindow = 2 but nothing uses them:
+trainset2.py pairs every child with every parent (recordlinkage Full()) and only turns the
+date difference into a feature afterwards. DateBlockIndex keeps the parents sorted on their
+publish day (integer days since 1970-01-01), so the parents of one day, or of any window of
+days, are one contiguous slice found with two binary searches. A child published on day d only
+meets parents published on days d - upwindow .. d + lowwindow, i.e. the news article appears
+at most upwindow days after the CBS report or lowwindow days before it.
+
+    index = DateBlockIndex.from_store(parents_clean)
+    for pairs in index.pairs_for_store(children_clean):     # DataFrames of (child_id, parent_id)
+        ...
+"""
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.scoring import article_dates
+
+# same values as in the legacy final_project_functions.py
+UPWINDOW = 7
+LOWWINDOW = 2
+
+# day of articles without a (parseable) publish date, they never meet anything
+NO_DAY = np.iinfo(np.int32).min
+
+
+def epoch_days(dates):
+    '''datetime64 values -> int32 days since 1970-01-01, NO_DAY for NaT'''
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    return np.where(np.isnat(dates), NO_DAY, days).astype(np.int32)
+
+
+def store_days(store, column='publish_date'):
+    '''(ids, epoch days) of every article in a store'''
+    return np.asarray(store.ids, dtype=np.int64), epoch_days(article_dates(store, column))
+
+
+class DateBlockIndex:
+    '''
+    Parent ids sorted on publish day. Parents without a date are left out.
+    '''
+
+    def __init__(self, ids, days):
+        ids = np.asarray(ids, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int32)
+        keep = days != NO_DAY
+        order = np.argsort(days[keep], kind='stable')
+        self.ids = ids[keep][order]
+        self.days = days[keep][order]
+
+    @classmethod
+    def from_store(cls, store, column='publish_date'):
+        return cls(*store_days(store, column))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def day_counts(self):
+        '''Number of parents per publish day'''
+        days, counts = np.unique(self.days, return_counts=True)
+        return pd.Series(counts, index=pd.to_datetime(days.astype('datetime64[D]')), name='parents')
+
+    def window(self, child_days, lowwindow=LOWWINDOW, upwindow=UPWINDOW):
+        '''(lo, hi): the parents of child i are ids[lo[i]:hi[i]]'''
+        child_days = np.asarray(child_days, dtype=np.int64)
+        lo = np.searchsorted(self.days, child_days - upwindow, side='left')
+        hi = np.searchsorted(self.days, child_days + lowwindow, side='right')
+        hi = np.where(child_days == NO_DAY, lo, hi)
+        return lo, hi
+
+    def parents_for(self, child_day, lowwindow=LOWWINDOW, upwindow=UPWINDOW):
+        '''Parent ids inside the window around one child's publish day'''
+        lo, hi = self.window([child_day], lowwindow, upwindow)
+        return self.ids[lo[0]:hi[0]]
+
+    def count_pairs(self, child_days, lowwindow=LOWWINDOW, upwindow=UPWINDOW):
+        lo, hi = self.window(child_days, lowwindow, upwindow)
+        return int((hi - lo).sum())
+
+    def pairs(self, child_ids, child_days, lowwindow=LOWWINDOW, upwindow=UPWINDOW, max_pairs=5_000_000):
+        '''
+        Yield DataFrames of blocked (child_id, parent_id) pairs, at most about max_pairs rows each
+        (a single child is never split over two frames).
+        '''
+        child_ids = np.asarray(child_ids, dtype=np.int64)
+        lo, hi = self.window(child_days, lowwindow, upwindow)
+        counts = hi - lo
+        ends = np.cumsum(counts)
+        start = 0
+        while start < len(child_ids):
+            # children start..stop together give at most max_pairs pairs (at least one child)
+            done = ends[start - 1] if start else 0
+            stop = max(int(np.searchsorted(ends, done + max_pairs, side='right')), start + 1)
+            c = counts[start:stop]
+            total = int(c.sum())
+            if total:
+                offsets = np.arange(total) - np.repeat(np.cumsum(c) - c, c) + np.repeat(lo[start:stop], c)
+                yield pd.DataFrame({'child_id': np.repeat(child_ids[start:stop], c),
+                                    'parent_id': self.ids[offsets]})
+            start = stop
+
+    def pairs_for_store(self, children, lowwindow=LOWWINDOW, upwindow=UPWINDOW, max_pairs=5_000_000):
+        '''pairs() for every child in a store'''
+        return self.pairs(*store_days(children), lowwindow, upwindow, max_pairs)
+
+
+def reduction_ratio(index, child_days, lowwindow=LOWWINDOW, upwindow=UPWINDOW):
+    '''Share of the Full() pairs that blocking removes (recordlinkage's reduction ratio)'''
+    full = len(child_days) * len(index)
+    return 1 - index.count_pairs(child_days, lowwindow, upwindow) / full if full else 0.0
@@ -0,0 +1,239 @@
+"""
+Text cleaning for Model A (legacy English stemming) and Model B (Dutch lemmas), plus an
+out-of-core chunked cleaning stage.
+
+The cleaning cell used to apply clean_text_dutch / clean_text_legacy to four columns of the
+fully loaded children_df and parents_df; a crash threw away hours of spaCy work. clean_chunked
+walks the corpus store in fixed-size id ranges, writes the clean_* columns of every range to
+its own parquet file and skips ranges that are already on disk, so a rerun after an
+interruption resumes at the first unfinished chunk. Memory is bounded by chunk_size.
+Every chunk records the version of the cleaner behind each column and a digest of the raw
+columns it was made from, so changing one cleaner only redoes that column and a chunk whose
+ids or raw text changed (a re-stitch) is redone. plan.json keeps a cheap fingerprint of every
+finished chunk (its ids, the store file's mtime/size, the cleaner versions), so on a rerun against
+the same store the raw text is only gathered and digested for chunks whose fingerprint changed.
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from nltk.stem import PorterStemmer
+from tqdm import tqdm
+
+from cbs_pipeline.lemmatize import DutchCleaner
+from cbs_pipeline.textcache import CachedCleaner
+
+ps = PorterStemmer()
+
+# Bump when the output of clean_text_legacy changes
+LEGACY_VERSION = 1
+
+# clean column -> raw column it is made from
+CLEAN_COLUMNS = {
+    'clean_title_dutch': 'title',
+    'clean_content_dutch': 'content',
+    'clean_title_legacy': 'title',
+    'clean_content_legacy': 'content',
+}
+
+
+# Dutch cleaning (Model B)
+def clean_text_dutch(text, nlp):
+    if not isinstance(text, str): return ""
+    text = text.lower()
+    text = re.sub(r'[^a-z0-9\s]', '', text)
+    doc = nlp(text)
+    # Keep lemmas (Dutch dictionary roots)
+    tokens = [token.lemma_ for token in doc if not token.is_stop]
+    return " ".join(tokens)
+
+
+# Legacy English cleaning (Model A)
+def clean_text_legacy(text):
+    if not isinstance(text, str): return ""
+    text = text.lower()
+
+    # Simple regex
+    text = re.sub(r'[^a-z0-9\s]', '', text)
+    tokens = text.split()
+    stems = [ps.stem(t) for t in tokens]
+    return " ".join(stems)
+
+
+class LegacyCleaner:
+    version = 'clean_text_legacy/v%d' % LEGACY_VERSION
+
+    def __call__(self, texts):
+        return [clean_text_legacy(t) for t in texts]
+
+
+def default_cleaners(nlp, n_process=1, batch_size=256, max_length=None, cache=None):
+    '''
+    clean column -> function that takes a list of raw texts and returns the cleaned list.
+    The Dutch columns go through DutchCleaner (batched nlp.pipe, n_process workers), which
+    gives the same strings as clean_text_dutch.
+    With a TextCache (see textcache.py) only texts that were never cleaned by the same
+    cleaner version get cleaned.
+    '''
+    dutch = DutchCleaner(nlp, n_process=n_process, batch_size=batch_size, max_length=max_length)
+    legacy = LegacyCleaner()
+    if cache is not None:
+        dutch, legacy = CachedCleaner(dutch, cache), CachedCleaner(legacy, cache)
+    return {
+        'clean_title_dutch': dutch,
+        'clean_content_dutch': dutch,
+        'clean_title_legacy': legacy,
+        'clean_content_legacy': legacy,
+    }
+
+
+def plan_chunks(ids, chunk_size, plan=None):
+    '''
+    Split sorted ids into id ranges [lo, hi] of chunk_size ids.
+    An existing plan is kept as is (so chunk files stay valid) and only extended with
+    new ranges for ids above the last planned range. A chunk owns every id above the
+    previous chunk's hi up to its own hi, so ids stitched in later always land in a chunk.
+    '''
+    ranges = list(plan['ranges']) if plan else []
+    start = 0
+    if ranges:
+        start = int(np.searchsorted(ids, ranges[-1][1], side='right'))
+    for i in range(start, len(ids), chunk_size):
+        block = ids[i:i + chunk_size]
+        ranges.append([int(block[0]), int(block[-1])])
+    return {'chunk_size': chunk_size, 'ranges': ranges}
+
+
+def chunk_path(output_dir, n):
+    return Path(output_dir) / ('chunk-%05d.parquet' % n)
+
+
+_VERSIONS_KEY = b'cbs_clean_versions'
+_DIGESTS_KEY = b'cbs_raw_digests'
+
+
+def _digest(values):
+    '''sha1 of a column of raw values, in order'''
+    sha = hashlib.sha1()
+    for value in values:
+        sha.update(value.encode('utf-8', 'surrogatepass'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def _chunk_info(path):
+    '''(ids, clean column -> cleaner version, raw column -> digest) of a chunk file on disk'''
+    metadata = pq.read_schema(path).metadata or {}
+    ids = pq.read_table(path, columns=['id'])['id'].to_numpy()
+    return ids, json.loads(metadata.get(_VERSIONS_KEY, b'{}')), json.loads(metadata.get(_DIGESTS_KEY, b'{}'))
+
+
+def store_versions(store):
+    '''
+    clean column -> cleaner version of a store built from clean_chunked output (build_store
+    keeps the parquet schema metadata), {} for a store without them.
+    '''
+    stored = (store.table.schema.metadata or {}).get(_VERSIONS_KEY)
+    return json.loads(stored) if stored else {}
+
+
+def _fingerprint(store, chunk_ids, versions, keep):
+    '''What a finished chunk depends on that is cheap to check: its ids, the store file and the cleaners'''
+    stat = os.stat(store.path)
+    ids = hashlib.sha1(np.ascontiguousarray(chunk_ids, dtype=np.int64).view(np.uint8)).hexdigest()
+    return {'ids': ids, 'store': [stat.st_mtime_ns, stat.st_size], 'versions': versions, 'keep': keep}
+
+
+def _write_plan(plan_file, plan):
+    tmp = plan_file.with_name(plan_file.name + '.tmp')
+    tmp.write_text(json.dumps(plan))
+    os.replace(tmp, plan_file)
+
+
+def _write_chunk(out, path, versions, digests):
+    table = pa.Table.from_pandas(out, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_VERSIONS_KEY] = json.dumps(versions).encode('utf-8')
+    metadata[_DIGESTS_KEY] = json.dumps(digests).encode('utf-8')
+    tmp = path.with_name(path.name + '.tmp')
+    pq.write_table(table.replace_schema_metadata(metadata), tmp)
+    os.replace(tmp, path)
+
+
+def clean_chunked(store, output_dir, cleaners, chunk_size=10_000, keep=('publish_date',)):
+    '''
+    Clean a corpus chunk by chunk with resumable checkpoints.
+
+    Input:
+        - store: CorpusStore with the raw columns (see store.py)
+        - output_dir: gets plan.json and one chunk-XXXXX.parquet per id range
+        - cleaners: clean column -> list-of-texts function (see default_cleaners);
+          the raw column comes from CLEAN_COLUMNS
+        - keep: raw columns that are copied along (the scoring cells need publish_date)
+    Output: the output_dir, ready for store.build_store(output_dir, ...)
+
+    A chunk is redone when its file is missing or holds other ids than the store has in that
+    range now (e.g. after new articles were stitched in, or one was swapped for another). A
+    clean column is redone when its cleaner version or the digest of its raw column changed
+    (text updated in place), the other columns of the chunk are kept. A chunk whose fingerprint
+    in plan.json still matches is skipped without reading the store.
+    '''
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    plan_file = output_dir / 'plan.json'
+    plan = json.loads(plan_file.read_text()) if plan_file.exists() else None
+    ids = store.ids
+    fingerprints = plan.get('fingerprints', {}) if plan else {}
+    plan = plan_chunks(ids, plan['chunk_size'] if plan else chunk_size, plan)
+    plan['fingerprints'] = fingerprints
+    _write_plan(plan_file, plan)
+
+    keep = [c for c in keep if c in store.columns]
+    raw_columns = sorted({CLEAN_COLUMNS[c] for c in cleaners} | set(keep))
+    versions = {column: getattr(func, 'version', None) for column, func in cleaners.items()}
+    done = 0
+    start = 0
+    for n, (lo, hi) in enumerate(tqdm(plan['ranges'])):
+        end = int(np.searchsorted(ids, hi, side='right'))
+        chunk_ids, start = ids[start:end], end
+        path = chunk_path(output_dir, n)
+        fingerprint = _fingerprint(store, chunk_ids, versions, keep)
+        if path.exists() and fingerprints.get(str(n)) == fingerprint:
+            done += 1
+            continue
+
+        raw = store.gather(chunk_ids, raw_columns, fill='')
+        text = {column: raw[column].astype(str).tolist() for column in raw_columns}
+        digests = {column: _digest(values) for column, values in text.items()}
+        todo = list(cleaners)
+        out = None
+        if path.exists():
+            on_disk_ids, on_disk, on_disk_digests = _chunk_info(path)
+            if np.array_equal(on_disk_ids, chunk_ids):
+                todo = [c for c in cleaners
+                        if on_disk.get(c) != versions[c] or on_disk_digests.get(CLEAN_COLUMNS[c]) != digests[CLEAN_COLUMNS[c]]]
+                if not todo and all(on_disk_digests.get(c) == digests[c] for c in keep):
+                    done += 1
+                    fingerprints[str(n)] = fingerprint
+                    _write_plan(plan_file, plan)
+                    continue
+                out = pd.read_parquet(path)
+
+        if out is None:
+            out = pd.DataFrame({'id': chunk_ids})
+        for column in keep:
+            out[column] = raw[column].values
+        for column in todo:
+            out[column] = cleaners[column](text[CLEAN_COLUMNS[column]])
+        _write_chunk(out, path, versions, digests)
+        fingerprints[str(n)] = fingerprint
+        _write_plan(plan_file, plan)
+    if done:
+        print(f"Resumed: {done} of {len(plan['ranges'])} chunks were already done.")
+    return output_dir
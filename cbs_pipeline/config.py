@@ -0,0 +1,53 @@
+"""
+Shared paths and file names, same idea as project_variables.py in the legacy folder.
+"""
+from pathlib import Path
+
+# DATA DIR (the OneDrive dump with the c_*.csv / p_*.csv files)
+data_dir = Path("data")
+
+# Stitched outputs
+children_file = "full_children.parquet"
+parents_file = "full_parents.parquet"
+matches_file = "full_matches.parquet"
+
+# Sorted (child, parent) -> % index next to full_matches.parquet (see matches.py)
+match_index_dir = "full_matches.idx"
+
+# Memory-mapped corpus stores built from the stitched outputs (see store.py)
+children_store = "full_children.arrow"
+parents_store = "full_parents.arrow"
+
+# The original aggregate of CBS reports, merged into full_parents
+all_parents_file = "all_parents.csv"
+
+# Cache of cleaned text keyed by cleaner version + raw text hash (see textcache.py)
+clean_cache_file = "clean_cache.sqlite"
+
+# Cleaned text stores written by the chunked cleaning stage (see cleaning.py)
+children_clean_store = "children_clean.arrow"
+parents_clean_store = "parents_clean.arrow"
+
+# Title/content document vectors of the cleaned articles (see vectors.py)
+children_vectors = "children_vectors"
+parents_vectors = "parents_vectors"
+
+# Legacy-cleaned title/content as token-id sets over a shared vocabulary (see tokensets.py)
+legacy_tokens_dir = "legacy_tokens"
+
+# MinHash LSH index over the legacy-cleaned parents, one per field (see minhash.py)
+minhash_dir = "parents_minhash"
+
+# Normalised number -> parent ids index (see numerals.py)
+parents_numbers_dir = "parents_numbers"
+
+# CBS taxonomy (Henk Laloli's database as processed by Legacy Files/process_taxonomie.py)
+taxonomy_file = "taxonomie_df.csv"
+taxonomy_store = "taxonomie.arrow"
+
+# Normalised CBS URL -> parent ids index for the match without model (see links.py)
+parents_links_dir = "parents_links"
+
+# Reconstructed trainset: the old flat file and the partitioned column store (see trainset_store.py)
+trainset_file = "trainset_reconstructed.csv"
+trainset_store = "trainset_reconstructed.store"
@@ -0,0 +1,131 @@
+"""
+Versioned trainset features, recomputed only when what they are made of changed.
+
+The scoring cell recomputed all features whenever anything changed, while their costs are far
+apart: the Dutch similarities need the spaCy doc vectors (hours for the full corpus), the legacy
+Jaccard needs the token sets, the dates and the legacy '%' take seconds. Here every feature group
+is written to the TrainsetStore together with the versions of its inputs:
+
+    dutch         title_sim_dutch, content_sim_dutch     pairs, versions.json of both vector dirs
+                                                         (Dutch cleaner version + spaCy model)
+    legacy        title_sim_legacy, content_sim_legacy   pairs, clean_*_legacy cleaner versions
+    dates         days_diff, date_binary                 pairs, DATE_WINDOW
+    match_score   %                                      pairs, digest of the match index
+
+update_features compares those with the current inputs and recomputes only the stale groups,
+the other columns are reused as they are. ensure_vectors compares the same Dutch versions, so a
+new clean_text_legacy (LEGACY_VERSION bump) recleans one column, rebuilds the token sets and
+redoes the legacy features; the vectors and the Dutch similarities stay. Inputs without a version
+(a store or vector dir built before versions were recorded) fall back to the file's mtime.
+
+    trainset_store = pair_store(store_path('trainset_reconstructed.csv'), trainset_new)
+    update_features(trainset_store, scorer, match_index, processes=4)
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from cbs_pipeline.cleaning import store_versions
+from cbs_pipeline.scoring import FEATURE_GROUPS, DATE_WINDOW, score_pairs
+from cbs_pipeline.trainset_store import TrainsetStore
+
+# every group stored in the trainset, the scoring ones plus the '%' from the match index
+STORE_GROUPS = dict(FEATURE_GROUPS, match_score=['%'])
+
+_PAIR_COLUMNS = ['child_id', 'parent_id', 'match']
+
+
+def _digest(*arrays):
+    sha = hashlib.sha1()
+    for array in arrays:
+        sha.update(np.ascontiguousarray(array).view(np.uint8))
+    return sha.hexdigest()
+
+
+def pairs_digest(child_ids, parent_ids):
+    '''sha1 of the pair list, in order'''
+    return _digest(np.asarray(child_ids, dtype=np.int64), np.asarray(parent_ids, dtype=np.int64))
+
+
+def _store_inputs(store, columns):
+    # cleaner version of every column, or the build time when the store has none
+    versions = store_versions(store)
+    if all(c in versions for c in columns):
+        return {c: versions[c] for c in columns}
+    return {'mtime': os.path.getmtime(store.path)}
+
+
+def _vector_inputs(vecs):
+    return vecs.versions or {'mtime': os.path.getmtime(vecs.path / 'ids.npy')}
+
+
+def feature_versions(scorer, child_ids, parent_ids, match_index=None):
+    '''
+    group -> versions of everything its columns are computed from, for the given pairs.
+    match_score is left out without a match_index.
+    '''
+    pairs = pairs_digest(child_ids, parent_ids)
+    legacy = ['clean_title_legacy', 'clean_content_legacy']
+    versions = {
+        'dutch': {'pairs': pairs, 'children': _vector_inputs(scorer.children_vecs),
+                  'parents': _vector_inputs(scorer.parents_vecs)},
+        'legacy': {'pairs': pairs, 'children': _store_inputs(scorer.children, legacy),
+                   'parents': _store_inputs(scorer.parents, legacy)},
+        'dates': {'pairs': pairs, 'window': DATE_WINDOW},
+    }
+    if match_index is not None:
+        versions['match_score'] = {'pairs': pairs, 'matches': _digest(match_index.keys, match_index.scores)}
+    return versions
+
+
+def stale_groups(store, versions):
+    '''Groups of versions with a column that is missing from the store or was made from other inputs'''
+    return [group for group, version in versions.items()
+            if any(store.versions.get(c) != version for c in STORE_GROUPS[group])]
+
+
+def update_features(store, scorer, match_index=None, processes=1, force=()):
+    '''
+    Bring the feature columns of a TrainsetStore up to date, recomputing only the stale groups.
+
+    Input:
+        - store: TrainsetStore with the child_id / parent_id pairs (see pair_store)
+        - scorer: scoring.PairScorer on the cleaned stores, vectors and token sets
+        - match_index: matches.MatchIndex for '%', None to leave '%' alone
+        - force: group names to recompute anyway (e.g. after replacing the raw corpus)
+    Output: the recomputed group names
+    '''
+    pairs = store.read(['child_id', 'parent_id'])
+    versions = feature_versions(scorer, pairs['child_id'], pairs['parent_id'], match_index)
+    stale = [g for g in versions if g in force or g in stale_groups(store, versions)]
+
+    scored = [g for g in stale if g in FEATURE_GROUPS]
+    if scored:
+        features = score_pairs(pairs['child_id'], pairs['parent_id'], scorer, processes=processes, groups=scored)
+        for group in scored:
+            for column in FEATURE_GROUPS[group]:
+                store.add_column(column, features[column], versions[group])
+    if 'match_score' in stale:
+        store.add_column('%', match_index.lookup(pairs['child_id'], pairs['parent_id']), versions['match_score'])
+
+    reused = [g for g in versions if g not in stale]
+    print(f"Recomputed {stale or 'nothing'}, reused {reused or 'nothing'}.")
+    return stale
+
+
+def pair_store(path, pairs):
+    '''
+    The TrainsetStore at path when it holds exactly these pairs (child_id, parent_id, match, same
+    order), so its feature columns can be reused; otherwise a new store with just the pairs.
+    '''
+    pairs = pairs[_PAIR_COLUMNS]
+    try:
+        store = TrainsetStore(path)
+        if len(store) == len(pairs) and all(c in store.columns for c in _PAIR_COLUMNS):
+            on_disk = store.read(_PAIR_COLUMNS)
+            if all(np.array_equal(on_disk[c].to_numpy(), pairs[c].to_numpy()) for c in _PAIR_COLUMNS):
+                return store
+    except FileNotFoundError:
+        pass
+    return TrainsetStore.create(path, pairs)
@@ -0,0 +1,192 @@
+"""
+Same-day hard negatives from the precomputed document vectors.
+
+The README puts the Phase 2 precision jump down to hard negatives (unrelated articles from the
+same day), but the sampling cell draws parents uniformly from the whole corpus, so almost every
+negative is trivially easy. HardNegativeMiner gives every child the k parents from its own
+publish-day bucket (DateBlockIndex, window 0 by default) that look most like it without being
+one of its known parents.
+
+Search: random-hyperplane LSH per day. Every parent unit vector gets a BITS-bit code in each of
+TABLES tables (bit j = which side of hyperplane j it is on, so similar vectors share codes), and
+every table is sorted on (publish day, code). A child looks up its own code, and the codes one
+bit away (multi-probe), for every day of its window with a binary search, so only the parents in
+those LSH buckets are touched, never the whole day. That shortlist is re-ranked with the exact
+cosine, known parents are dropped and the top k are kept. Children with a dateless day or no
+colliding parent get no hard negatives; a parent that collides with none of the probes is missed
+(more tables or probes raise the recall, see mine).
+
+    miner = HardNegativeMiner.from_store(parents_clean, parents_vecs)
+    negatives = miner.mine(child_ids, child_days, children_vecs, known_parents, k=1)
+"""
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.blocking import DateBlockIndex, NO_DAY
+
+# LSH tables and code bits per table (a code is one of 2 ** BITS buckets within a day)
+TABLES = 12
+BITS = 8
+
+# shortlist pairs per exact cosine step (bounds the gathered vectors to _PAIRS x dim floats)
+_PAIRS = 100_000
+
+
+def hyperplanes(dim, seed=42):
+    '''(TABLES, dim, BITS) random hyperplanes'''
+    return np.random.default_rng(seed).standard_normal((TABLES, dim, BITS)).astype(np.float32)
+
+
+def lsh_codes(vectors, planes):
+    '''(TABLES, n) int64 codes: bit j of table t is set when the vector is on the positive side of plane j'''
+    bits = np.einsum('nd,tdb->tnb', vectors, planes) > 0
+    return (bits * (1 << np.arange(planes.shape[2], dtype=np.int64))).sum(axis=2)
+
+
+def _expand(lo, hi):
+    '''(query row, position) for every position in lo[i]:hi[i]'''
+    counts = hi - lo
+    rows = np.repeat(np.arange(len(lo)), counts)
+    positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    return rows, positions
+
+
+def _rank_within(groups):
+    '''0, 1, 2, ... within every run of equal values of a sorted array'''
+    n = len(groups)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if n else np.zeros(0, dtype=np.int64)
+    return np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+
+
+class HardNegativeMiner:
+    '''
+    Input:
+        - parent_vecs: DocVectors of the parents
+        - blocks: DateBlockIndex over the parents (only parents with a vector are used)
+        - field: 'content' or 'title' vectors
+    '''
+
+    def __init__(self, parent_vecs, blocks, field='content', seed=42):
+        pos = parent_vecs.positions(blocks.ids)
+        keep = pos >= 0
+        keep[keep] = np.asarray(parent_vecs.norms[field])[pos[keep]] > 0
+        self.blocks = DateBlockIndex(blocks.ids[keep], blocks.days[keep])
+        self.field = field
+        # unit vector of every parent, in the order of self.blocks.ids
+        vectors, norms = parent_vecs.gather(self.blocks.ids, field)
+        self.unit = vectors / norms[:, None] if len(vectors) else vectors
+        self.planes = hyperplanes(parent_vecs.dim, seed)
+        # hyperplanes through the mean: doc vectors share a big common direction, which would
+        # otherwise put most parents of a day on the same side of every plane
+        self.center = self.unit.mean(axis=0) if len(self.unit) else np.zeros(parent_vecs.dim, np.float32)
+        # per table: positions in self.blocks sorted on (day, code), and those sorted keys
+        keys = self._keys(self.blocks.days, lsh_codes(self.unit - self.center, self.planes))
+        self.order = np.argsort(keys, axis=1, kind='stable')
+        self.keys = np.take_along_axis(keys, self.order, axis=1)
+
+    @classmethod
+    def from_store(cls, parents, parent_vecs, field='content', seed=42):
+        '''Buckets on the publish dates of a parents CorpusStore (e.g. parents_clean)'''
+        return cls(parent_vecs, DateBlockIndex.from_store(parents), field, seed)
+
+    @staticmethod
+    def _keys(days, codes):
+        return np.asarray(days, dtype=np.int64)[None, :] * (1 << BITS) + codes
+
+    def _candidates(self, codes, days, lowwindow, upwindow, multiprobe):
+        '''Distinct (child row, parent position) pairs that share an LSH bucket in some table'''
+        masks = [0] + ([1 << j for j in range(BITS)] if multiprobe else [])
+        rows, positions = [], []
+        for t in range(len(self.keys)):
+            for mask in masks:
+                for offset in range(-upwindow, lowwindow + 1):
+                    query = self._keys(days + offset, codes[t:t + 1] ^ mask)[0]
+                    lo = np.searchsorted(self.keys[t], query, side='left')
+                    hi = np.searchsorted(self.keys[t], query, side='right')
+                    r, p = _expand(lo, hi)
+                    rows.append(r)
+                    positions.append(self.order[t][p])
+        pairs = np.unique(np.concatenate(rows) * len(self.blocks.ids) + np.concatenate(positions))
+        return pairs // len(self.blocks.ids), pairs % len(self.blocks.ids)
+
+    def mine(self, child_ids, child_days, child_vecs, known, k=1, lowwindow=0, upwindow=0,
+             multiprobe=True, chunk_size=20_000):
+        '''
+        DataFrame (child_id, parent_id, similarity, rank) with at most k hard negatives per
+        distinct child, rank 0 = most similar.
+
+        Input:
+            - child_ids, child_days: the children (e.g. of the positives) and their epoch days
+              (blocking.store_days); duplicates are mined once
+            - child_vecs: DocVectors of the children
+            - known: sampling.KnownParents, none of a child's known parents is returned
+            - lowwindow, upwindow: widen the bucket to more days (see DateBlockIndex.window)
+            - multiprobe: also look in the buckets one code bit away (BITS more lookups per table)
+        '''
+        child_ids, first = np.unique(np.asarray(child_ids, dtype=np.int64), return_index=True)
+        child_days = np.asarray(child_days, dtype=np.int64)[first]
+        frames = []
+        for start in range(0, len(child_ids), chunk_size):
+            ids, days = child_ids[start:start + chunk_size], child_days[start:start + chunk_size]
+            vectors, norms = child_vecs.gather(ids, self.field)
+            ok = (norms > 0) & (days != NO_DAY)
+            ids, days = ids[ok], days[ok]
+            if len(ids) == 0 or len(self.blocks.ids) == 0:
+                continue
+            unit = vectors[ok] / norms[ok, None]
+            codes = lsh_codes(unit - self.center, self.planes)
+            rows, positions = self._candidates(codes, days, lowwindow, upwindow, multiprobe)
+
+            # exact cosine on the shortlist, without the known parents
+            parent_ids = self.blocks.ids[positions]
+            keep = ~known.contains(ids[rows], parent_ids)
+            rows, positions, parent_ids = rows[keep], positions[keep], parent_ids[keep]
+            similarity = np.zeros(len(rows), dtype=np.float32)
+            for s in range(0, len(rows), _PAIRS):
+                similarity[s:s + _PAIRS] = np.einsum('nd,nd->n', unit[rows[s:s + _PAIRS]],
+                                                     self.unit[positions[s:s + _PAIRS]])
+            top = self._top_k(ids, rows, parent_ids, similarity, k)
+            if top is not None:
+                frames.append(top)
+        if not frames:
+            return pd.DataFrame({'child_id': np.zeros(0, np.int64), 'parent_id': np.zeros(0, np.int64),
+                                 'similarity': np.zeros(0, np.float32), 'rank': np.zeros(0, np.int64)})
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _top_k(ids, rows, parent_ids, similarity, k):
+        # the shortlists (rows are sorted) as one padded matrix, top k per row with argpartition
+        width = int(np.bincount(rows).max()) if len(rows) else 0
+        if width == 0:
+            return None
+        matrix = np.full((len(ids), width), -np.inf, dtype=np.float32)
+        parents = np.zeros((len(ids), width), dtype=np.int64)
+        column = _rank_within(rows)
+        matrix[rows, column] = similarity
+        parents[rows, column] = parent_ids
+        kk = min(k, width)
+        top = np.argpartition(-matrix, kk - 1, axis=1)[:, :kk]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(matrix, top, axis=1), axis=1, kind='stable'), axis=1)
+        best = np.take_along_axis(matrix, top, axis=1)
+        valid = np.isfinite(best)
+        return pd.DataFrame({'child_id': np.repeat(ids, kk)[valid.ravel()],
+                             'parent_id': np.take_along_axis(parents, top, axis=1)[valid],
+                             'similarity': best[valid],
+                             'rank': np.broadcast_to(np.arange(kk), top.shape)[valid]})
+
+
+def hard_training_pairs(child_ids, parent_ids, negatives):
+    '''
+    Positives (match=1) followed by the hard negatives of their child (match=0). A child with
+    several positives gets its negatives once, after its last positive.
+    '''
+    positives = pd.DataFrame({'child_id': np.asarray(child_ids, dtype=np.int64),
+                              'parent_id': np.asarray(parent_ids, dtype=np.int64), 'match': 1})
+    positives['_order'] = np.arange(len(positives))
+    negatives = negatives[['child_id', 'parent_id']].assign(match=0)
+    last = positives.groupby('child_id')['_order'].max()
+    negatives['_order'] = negatives['child_id'].map(last)
+    negatives = negatives.dropna(subset=['_order'])
+    pairs = pd.concat([positives, negatives], ignore_index=True)
+    pairs = pairs.sort_values(['_order', 'match'], ascending=[True, False], kind='stable')
+    return pairs.drop(columns='_order').reset_index(drop=True)
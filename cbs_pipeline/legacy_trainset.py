@@ -0,0 +1,255 @@
+"""
+Batch version of Legacy Files/trainset2.py: the legacy (A0) feature set for any number of pairs.
+
+trainset2.py handles one pair per loop iteration: it reads c_<id>.csv, re-reads all_parents.csv
+and reruns preprocessing_parent (taxonomy expansion included) for a single parent, finds the
+other parents of the child with an O(n^2) list.index scan over the whole trainset, builds a
+recordlinkage Full() index plus Jaro-Winkler compare for that one pair and grows its output
+frames with .append. Here:
+
+    - every parent in the pairs is read from the parents store and preprocessed once
+      (normalize.Normalizer, TaxonomyMatcher.expand for Gebruik_UF / BT_TT)
+    - pairs are grouped by child; a chunk of child groups is one task for a process pool, each
+      worker preprocesses its children once and computes the rules and the lexical features of
+      all their pairs in one go (lexical.LexicalFeatures), parents are sent to a worker once
+    - title_similarity / content_similarity come from one nlp.pipe pass per distinct text
+      (vectors.doc_vectors), not two nlp() calls per pair
+    - both outputs are concatenated once at the end and written in one go
+
+The link rule (Jaro-Winkler >= 0.93 between the parent link and the child's cbs_link) is a
+comparison of normalised URLs (links.normalize_url), see links.py.
+
+    python -m cbs_pipeline.legacy_trainset --output-dir legacy_baseline --processes 8
+"""
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from cbs_pipeline.config import data_dir
+from cbs_pipeline.lexical import BLOCKS, LexicalFeatures, jac_total
+from cbs_pipeline.links import extract_links, normalize_url
+from cbs_pipeline.normalize import Normalizer, prepare_child_text, prepare_parent_text
+from cbs_pipeline.sampling import KnownParents, sample_negatives
+from cbs_pipeline.scoring import parse_dates
+from cbs_pipeline.taxonomy import TaxonomyMatcher
+from cbs_pipeline.vectors import cosine, doc_vectors
+
+# output columns of trainset2.py
+FEATURE_COLUMNS = ['child_id', 'parent_id', 'match', 'date_binary', 'jac_total', 'title_similarity',
+                   'content_similarity'] + [f"{block}_lenmatches" for block in BLOCKS]
+ZM_COLUMNS = ['c', 'p', '%', 'sleutelwoorden', 'BT_TT', 'titel', '1st_para', 'getallen']
+
+PARENT_COLUMNS = ['id', 'publish_date', 'title', 'content', 'link', 'taxonomies']
+CHILD_COLUMNS = ['id', 'publish_date', 'title', 'content']
+
+
+def legacy_pairs(children, parents, random_state=42):
+    '''
+    The pairs trainset2.py builds: every child with exactly one related parent that is in the
+    parents store (match=1), plus one random negative per positive drawn from the positives'
+    parents, never one of the child's own (match=0).
+    '''
+    df = children.gather(children.ids, ['id', 'related_parents']).dropna(subset=['related_parents'])
+    related = df['related_parents'].astype(str).str.replace('[matches/]', '', regex=True)
+    single = ~related.str.contains(',')
+    df = pd.DataFrame({'child_id': df['id'][single].astype('int64'),
+                       'parent_id': pd.to_numeric(related[single], errors='coerce')}).dropna()
+    df = df[parents.contains(df['parent_id'].astype('int64'))].astype('int64')
+
+    child_ids, parent_ids = df['child_id'].to_numpy(), df['parent_id'].to_numpy()
+    known = KnownParents.from_pairs(child_ids, parent_ids)
+    negatives = sample_negatives(child_ids, known, parent_ids, k=1, random_state=random_state)[:, 0]
+    return pd.DataFrame({'child_id': np.r_[child_ids, child_ids], 'parent_id': np.r_[parent_ids, negatives],
+                         'match': np.r_[np.ones(len(df), np.int64), np.zeros(len(df), np.int64)]})
+
+
+def prepare_parents(parents, parent_ids, normalizer, matcher):
+    '''preprocessing_parent for the given parent ids, once each: DataFrame indexed on id'''
+    raw = parents.gather(np.unique(np.asarray(parent_ids, dtype=np.int64)), PARENT_COLUMNS)
+    raw = raw.dropna(subset=['id'])
+    titles, contents = zip(*map(prepare_parent_text, raw['title'], raw['content'])) if len(raw) else ((), ())
+    df = normalizer.parents(pd.DataFrame({'title': titles, 'content': contents}, index=raw.index), prepared=True)
+    df['id'] = raw['id'].astype('int64')
+    df['title'] = titles
+    df['link'] = raw['link']
+    df['publish_date'] = parse_dates(raw['publish_date'])
+    df['taxonomies'] = raw['taxonomies']
+    df['Gebruik_UF'], df['BT_TT'] = zip(*map(matcher.expand, raw['taxonomies'])) if len(raw) else ((), ())
+    df['link_url'] = [normalize_url(link) for link in raw['link']]
+    return df.set_index('id')
+
+
+# per worker process: the prepared parents and their lexical term lists
+_worker = {}
+
+
+def _init_worker(parents_frame, stop_words):
+    _worker['parents'] = parents_frame
+    _worker['normalizer'] = Normalizer(stop_words)
+    _worker['lexical'] = LexicalFeatures(pd.DataFrame({'content_child_no_stop': [], 'child_numbers': []}),
+                                         parents_frame)
+
+
+def _build_chunk(raw_children, child_ids, parent_ids, match, rows):
+    '''
+    The per-child part of trainset2.py for a chunk of child groups.
+    Returns (feature rows without the similarities, match-without-model rows, child texts).
+    '''
+    parents = _worker['parents']
+    raw_children = raw_children.dropna(subset=['id']).drop_duplicates('id')
+    titles, contents = zip(*map(prepare_child_text, raw_children['title'], raw_children['content'])) \
+        if len(raw_children) else ((), ())
+    children = _worker['normalizer'].children(pd.DataFrame({'title': titles, 'content': contents}), prepared=True)
+    children.index = pd.Index(raw_children['id'].astype('int64').to_numpy())
+    children['content'] = contents
+    children['publish_date'] = parse_dates(raw_children['publish_date'])
+    children['cbs_link'] = extract_links(list(contents)).to_numpy()
+
+    # children without a row are skipped, like a missing c_<id>.csv
+    found = children.index.get_indexer(child_ids) >= 0
+    child_ids, parent_ids, match, rows = child_ids[found], parent_ids[found], match[found], rows[found]
+    child = children.loc[child_ids]
+    parent = parents.loc[parent_ids]
+
+    # rules before the model: whole parent title in the child content, or the same CBS link
+    whole_title = np.array([t in c for t, c in zip(parent['title'], child['content'])], dtype=np.int64)
+    link_score = np.array([u is not None and u == normalize_url(l) for u, l in zip(parent['link_url'], child['cbs_link'])],
+                          dtype=np.int64)
+    shortcut = (whole_title + link_score) > 0
+    zm = pd.DataFrame({'c': child_ids[shortcut], 'p': parent_ids[shortcut],
+                       '%': ["{0:.4f}".format(v) for v in np.clip(whole_title + link_score, 0, 1)[shortcut]]})
+    for column in ZM_COLUMNS[3:]:
+        zm[column] = ''
+    zm['_row'] = rows[shortcut]
+
+    keep = ~shortcut
+    child_ids, parent_ids, match, rows = child_ids[keep], parent_ids[keep], match[keep], rows[keep]
+    lexical = _worker['lexical'].with_children(children).compute(child_ids, parent_ids)
+    days = (pd.Series(parents.loc[parent_ids, 'publish_date'].to_numpy()) -
+            pd.Series(children.loc[child_ids, 'publish_date'].to_numpy())).abs().dt.days.astype(float).to_numpy()
+    features = pd.DataFrame({'child_id': child_ids, 'parent_id': parent_ids, 'match': match,
+                             'date_binary': np.where(np.isnan(days), np.nan, (days < 2).astype(float)),
+                             'jac_total': jac_total(lexical)})
+    for block in BLOCKS:
+        features[f"{block}_lenmatches"] = lexical[f"{block}_lenmatches"]
+    features['_row'] = rows
+
+    texts = children.loc[np.unique(child_ids), ['title_child_no_stop', 'content_child_no_stop']]
+    return features, zm, texts
+
+
+def _similarities(nlp, features, parents, child_texts, batch_size=256, n_process=1):
+    '''title_similarity / content_similarity like similarity(row, nlp): every distinct text through nlp once'''
+    out = {}
+    for column, parent_column, child_column in (('title_similarity', 'title_without_stopwords', 'title_child_no_stop'),
+                                                ('content_similarity', 'content_without_stopwords', 'content_child_no_stop')):
+        if nlp is None:
+            out[column] = np.zeros(len(features))
+            continue
+        p_vectors, p_norms = doc_vectors(nlp, parents[parent_column].tolist(), batch_size, n_process)
+        c_vectors, c_norms = doc_vectors(nlp, child_texts[child_column].tolist(), batch_size, n_process)
+        p = parents.index.get_indexer(features['parent_id'])
+        c = child_texts.index.get_indexer(features['child_id'])
+        out[column] = cosine(c_vectors[c], c_norms[c], p_vectors[p], p_norms[p]).astype(np.float64)
+    return out
+
+
+def build_legacy_trainset(pairs, children, parents, nlp=None, matcher=None, stop_words=None,
+                          chunk_children=2_000, processes=1, n_process=1):
+    '''
+    final_trainset and final_trainset_zm of trainset2.py for all pairs at once.
+
+    Input:
+        - pairs: DataFrame (child_id, parent_id, match), e.g. legacy_pairs(children, parents)
+        - children, parents: the raw corpus stores (open_children / open_parents)
+        - nlp: the spaCy model for title_similarity / content_similarity (None: both 0)
+        - matcher: TaxonomyMatcher (default: TaxonomyMatcher.from_file())
+        - processes: > 1 runs the child groups in a process pool
+    Output: (final_trainset with FEATURE_COLUMNS, final_trainset_zm with ZM_COLUMNS),
+            non-matches first like the legacy concat
+    '''
+    normalizer = Normalizer(stop_words)
+    matcher = matcher or TaxonomyMatcher.from_file(stop_words=normalizer.stop_words)
+    child_ids = pairs['child_id'].to_numpy(np.int64)
+    parent_ids = pairs['parent_id'].to_numpy(np.int64)
+    match = pairs['match'].to_numpy(np.int64)
+
+    parents_frame = prepare_parents(parents, parent_ids, normalizer, matcher)
+    known = parents_frame.index.get_indexer(parent_ids) >= 0
+    rows = np.flatnonzero(known)
+    order = rows[np.argsort(child_ids[rows], kind='stable')]
+    groups = np.unique(child_ids[order])
+
+    sorted_children = child_ids[order]
+    starts = np.searchsorted(sorted_children, groups[::chunk_children])
+    ends = np.r_[starts[1:], len(order)].astype(np.int64)
+
+    def task(i):
+        sel = order[starts[i]:ends[i]]
+        chunk = groups[i * chunk_children:(i + 1) * chunk_children]
+        return children.gather(chunk, CHILD_COLUMNS), child_ids[sel], parent_ids[sel], match[sel], sel
+
+    parts = []
+    if processes == 1:
+        _init_worker(parents_frame, normalizer.stop_words)
+        for i in tqdm(range(len(starts))):
+            parts.append(_build_chunk(*task(i)))
+    else:
+        with ProcessPoolExecutor(processes, initializer=_init_worker,
+                                 initargs=(parents_frame, normalizer.stop_words)) as pool, \
+                tqdm(total=len(starts)) as progress:
+            pending = deque()
+            for i in range(len(starts)):
+                pending.append(pool.submit(_build_chunk, *task(i)))
+                if len(pending) >= 2 * processes:
+                    parts.append(pending.popleft().result())
+                    progress.update(1)
+            while pending:
+                parts.append(pending.popleft().result())
+                progress.update(1)
+
+    features = pd.concat([p[0] for p in parts], ignore_index=True) if parts else pd.DataFrame(columns=FEATURE_COLUMNS + ['_row'])
+    zm = pd.concat([p[1] for p in parts], ignore_index=True) if parts else pd.DataFrame(columns=ZM_COLUMNS + ['_row'])
+    child_texts = pd.concat([p[2] for p in parts]) if parts else pd.DataFrame(columns=['title_child_no_stop', 'content_child_no_stop'])
+    for column, values in _similarities(nlp, features, parents_frame, child_texts, n_process=n_process).items():
+        features[column] = values
+
+    # trainset2.py: concat([non-matches, matches]), each in trainset order
+    features = features.sort_values(['match', '_row'], kind='stable')
+    features = features[FEATURE_COLUMNS].fillna(0).reset_index(drop=True)
+    zm = zm.merge(pd.DataFrame({'_row': np.arange(len(match)), '_match': match}), on='_row', how='left')
+    zm = zm.sort_values(['_match', '_row'], kind='stable')[ZM_COLUMNS].reset_index(drop=True)
+    skipped = len(pairs) - len(features) - len(zm)
+    print(f"Success! {len(features)} feature rows, {len(zm)} matched without model, {skipped} pairs skipped.")
+    return features, zm
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Legacy (A0) trainset, batch version of trainset2.py")
+    parser.add_argument('--data-dir', default=str(data_dir))
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--model', default='nl_core_news_lg', help="spaCy model for the similarities, '' to skip")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--random-state', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    from cbs_pipeline.store import open_children, open_parents
+    children, parents = open_children(args.data_dir), open_parents(args.data_dir)
+    nlp = None
+    if args.model:
+        import spacy
+        nlp = spacy.load(args.model)
+    pairs = legacy_pairs(children, parents, args.random_state)
+    features, zm = build_legacy_trainset(pairs, children, parents, nlp, processes=args.processes)
+    output_dir = Path(args.output_dir)
+    features.to_csv(output_dir / 'final_trainset.csv', index=False)
+    zm.to_csv(output_dir / 'final_trainset_zm.csv', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Batched, multi-process Dutch lemmatization (the engine behind clean_text_dutch).
+
+clean_text_dutch calls nlp(text) one document at a time through Series.apply, so spaCy never
+batches and never uses more than one core, and title and content of children and parents are
+four separate passes. DutchCleaner takes whole columns, does the same lowercase / punctuation
+strip, runs everything through a single nlp.pipe with configurable n_process and batch_size,
+and returns the lemma/stopword-filtered strings in the input order. Identical texts (the same
+title shows up in many syndicated articles) are only lemmatized once.
+
+Throughput benchmark, to size machines for the 350k corpus:
+    python -m cbs_pipeline.lemmatize --sample 2000 --n-process 1 2 4 --batch-size 64 256
+"""
+import argparse
+import os
+import re
+import time
+
+import pandas as pd
+
+_PUNCT = re.compile(r'[^a-z0-9\s]')
+
+# Bump when the output of the Dutch cleaning changes, so cached / chunked results get redone
+VERSION = 1
+
+
+def model_version(nlp):
+    '''nl_core_news_lg-3.7.0 for a loaded spaCy pipeline'''
+    meta = getattr(nlp, 'meta', {})
+    return "%s_%s-%s" % (meta.get('lang', ''), meta.get('name', ''), meta.get('version', ''))
+
+
+def prepare(text, max_length=None):
+    '''Same normalisation clean_text_dutch does before calling nlp'''
+    if not isinstance(text, str):
+        return ""
+    text = _PUNCT.sub('', text.lower())
+    return text[:max_length] if max_length else text
+
+
+def lemmas(doc):
+    # Keep lemmas (Dutch dictionary roots)
+    return " ".join(token.lemma_ for token in doc if not token.is_stop)
+
+
+class DutchCleaner:
+    '''
+    Column-at-a-time version of clean_text_dutch.
+
+    Input:
+        - nlp: an already loaded pipeline, or None to load `model`
+        - n_process: worker processes for nlp.pipe (each loads its own copy of the model)
+        - batch_size: documents per batch handed to spaCy
+        - max_length: truncate texts to this many characters (default: nlp.max_length, which
+          would otherwise raise on very long articles)
+    '''
+
+    def __init__(self, nlp=None, model="nl_core_news_lg", n_process=1, batch_size=256, max_length=None,
+                 disable=('ner', 'parser')):
+        if nlp is None:
+            import spacy
+            nlp = spacy.load(model, disable=list(disable))
+        self.nlp = nlp
+        self.n_process = n_process
+        self.batch_size = batch_size
+        self.max_length = max_length or getattr(nlp, 'max_length', None)
+
+    @property
+    def version(self):
+        '''clean_text_dutch/v1/nl_core_news_lg-3.7.0: cleaner version plus spaCy model version'''
+        return "clean_text_dutch/v%d/%s" % (VERSION, model_version(self.nlp))
+
+    def clean(self, texts):
+        '''List of raw texts in, list of cleaned strings out (same order)'''
+        prepared = [prepare(t, self.max_length) for t in texts]
+        unique = list(dict.fromkeys(t for t in prepared if t))
+        docs = self.nlp.pipe(unique, n_process=self.n_process, batch_size=self.batch_size)
+        cleaned = {text: lemmas(doc) for text, doc in zip(unique, docs)}
+        cleaned[""] = ""
+        return [cleaned[t] for t in prepared]
+
+    def clean_columns(self, columns):
+        '''
+        Several columns (name -> list of texts) through one nlp.pipe pass instead of one pass each.
+        Returns name -> list of cleaned strings.
+        '''
+        names = list(columns)
+        lengths = [len(columns[n]) for n in names]
+        flat = [t for n in names for t in columns[n]]
+        cleaned = self.clean(flat)
+        out = {}
+        start = 0
+        for name, n in zip(names, lengths):
+            out[name] = cleaned[start:start + n]
+            start += n
+        return out
+
+    __call__ = clean
+
+
+def benchmark(texts, n_process_values=(1,), batch_sizes=(256,), nlp=None, model="nl_core_news_lg"):
+    '''
+    Docs/sec (and docs/sec per core) for every n_process x batch_size combination.
+    Texts are made unique first so the dedup in clean() doesn't flatter the numbers.
+    '''
+    texts = ["%d %s" % (i, t) for i, t in enumerate(texts)]
+    cleaner = DutchCleaner(nlp, model)
+    rows = []
+    for n_process in n_process_values:
+        for batch_size in batch_sizes:
+            cleaner.n_process = n_process
+            cleaner.batch_size = batch_size
+            start = time.perf_counter()
+            cleaner.clean(texts)
+            seconds = time.perf_counter() - start
+            rows.append({'n_process': n_process, 'batch_size': batch_size, 'docs': len(texts),
+                         'seconds': round(seconds, 2),
+                         'docs_per_sec': round(len(texts) / seconds, 1),
+                         'docs_per_sec_per_core': round(len(texts) / seconds / n_process, 1)})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput benchmark for the Dutch lemmatizer")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--column', default='content', help="title or content")
+    parser.add_argument('--sample', type=int, default=2000)
+    parser.add_argument('--n-process', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[64, 256])
+    args = parser.parse_args(argv)
+
+    from cbs_pipeline.store import open_children
+    store = open_children(args.data_dir)
+    texts = store.gather(store.ids[:args.sample], args.column, fill='')[args.column].tolist()
+    print(benchmark(texts, args.n_process, args.batch_size).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
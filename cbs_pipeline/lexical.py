@@ -0,0 +1,167 @@
+"""
+Columnar extractor for the legacy lexical feature block of trainset2.py.
+
+find_sleutelwoorden_UF, find_BT_TT, find_title_no_stop, find_1st_paragraph_no_stop and
+find_numbers are applied with features.apply(..., axis=1): a pd.Series per row per function,
+and the punctuation strip of the child's content_child_no_stop redone in every one of them for
+every pair. LexicalFeatures prepares every child text once (punctuation-free content, content
+without 'cbs', joined numbers) and every parent's term list once (distinct terms and the
+jaccard denominator), then walks the pairs grouped by child and writes jaccard / lenmatches
+(and optionally the matched sets) straight into preallocated NumPy arrays. Per child the
+`term in content` answers are memoised, parents that share terms with each other don't test
+them twice.
+
+Values are those of the legacy functions, quirks included:
+    - find_1st_paragraph_no_stop matches against content_child_no_stop with only 'cbs' removed
+      (its punctuation strip is overwritten on the next line)
+    - sleutelwoorden is 0 when Gebruik_UF is a single word (see TaxonomyMatcher.sleutelwoorden_terms)
+    - an empty term list is [''], which always matches (jaccard 1)
+    - numbers is 0 for parents without numbers (ZeroDivisionError in the legacy try)
+
+    extractor = LexicalFeatures(children, parents)     # frames indexed on id, legacy derived columns
+    features = extractor.frame(pairs['child_id'], pairs['parent_id'])
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.taxonomy import TaxonomyMatcher
+
+# feature prefixes, in trainset2.py order
+BLOCKS = ('sleutelwoorden', 'BT_TT', 'title_no_stop', '1st_paragraph_no_stop', 'numbers')
+
+# which prepared child text every block matches against
+_CONTENT = {'sleutelwoorden': 0, 'BT_TT': 0, 'title_no_stop': 0, '1st_paragraph_no_stop': 1, 'numbers': 2}
+
+
+def feature_columns(with_matches=False):
+    suffixes = ('jaccard', 'lenmatches', 'matches') if with_matches else ('jaccard', 'lenmatches')
+    return [f"{block}_{suffix}" for block in BLOCKS for suffix in suffixes]
+
+
+def _terms(values):
+    '''(distinct terms in order, jaccard denominator), None where the legacy function returns zeros'''
+    if values is None:
+        return None
+    distinct = list(dict.fromkeys(values))
+    if not distinct:
+        return None
+    return distinct, len(distinct)
+
+
+def _split(text):
+    return text.split(' ') if isinstance(text, str) else None
+
+
+class LexicalFeatures:
+    '''
+    Input:
+        - children: DataFrame indexed on child id with content_child_no_stop and child_numbers
+        - parents: DataFrame indexed on parent id with taxonomies, title_without_stopwords,
+          first_paragraph_without_stopwords and parent_numbers; Gebruik_UF and BT_TT are taken
+          from the frame when present, else expanded with the matcher
+        - matcher: TaxonomyMatcher (default: TaxonomyMatcher.from_file(), only needed without Gebruik_UF/BT_TT)
+    '''
+
+    def __init__(self, children, parents, matcher=None):
+        self._set_children(children)
+        self.parent_index = pd.Index(parents.index)
+
+        if 'Gebruik_UF' in parents and 'BT_TT' in parents:
+            gebruik_uf, bt_tt = parents['Gebruik_UF'], parents['BT_TT']
+        else:
+            matcher = matcher or TaxonomyMatcher.from_file()
+            gebruik_uf, bt_tt = zip(*map(matcher.expand, parents['taxonomies'])) if len(parents) else ((), ())
+        self.parent_terms = [self.prepare_parent(*row) for row in
+                             zip(parents['taxonomies'], gebruik_uf, bt_tt, parents['title_without_stopwords'],
+                                 parents['first_paragraph_without_stopwords'], parents['parent_numbers'])]
+
+    def _set_children(self, children):
+        self.child_index = pd.Index(children.index)
+        self.child_texts = [self.prepare_child(c, n) for c, n in
+                            zip(children['content_child_no_stop'], children['child_numbers'])]
+
+    def with_children(self, children):
+        '''Same parents (their term lists are not prepared again), other children'''
+        other = copy.copy(self)
+        other._set_children(children)
+        return other
+
+    @staticmethod
+    def prepare_child(content_no_stop, numbers):
+        '''(content without punctuation, content without 'cbs', joined numbers); text entries None for NaN content'''
+        joined = ' '.join(numbers) if isinstance(numbers, (list, tuple, np.ndarray)) else None
+        if not isinstance(content_no_stop, str):
+            return None, None, joined
+        return TaxonomyMatcher.prepare_content(content_no_stop), content_no_stop.replace('cbs', ''), joined
+
+    @staticmethod
+    def prepare_parent(taxonomies, gebruik_uf, bt_tt, title_no_stop, first_paragraph_no_stop, numbers):
+        '''Per block the output of _terms'''
+        numbers = list(numbers) if isinstance(numbers, (list, tuple, np.ndarray)) else None
+        return (_terms(TaxonomyMatcher.sleutelwoorden_terms(taxonomies, gebruik_uf)),
+                _terms(_split(bt_tt)),
+                _terms(_split(title_no_stop)),
+                _terms(_split(first_paragraph_no_stop)),
+                _terms(numbers))
+
+    def compute(self, child_ids, parent_ids, with_matches=False):
+        '''
+        {column: array} for every pair, columns as in feature_columns(with_matches):
+        float64 *_jaccard, int64 *_lenmatches and object *_matches (sets).
+        '''
+        child_pos = self.child_index.get_indexer(np.asarray(child_ids))
+        parent_pos = self.parent_index.get_indexer(np.asarray(parent_ids))
+        if (child_pos < 0).any() or (parent_pos < 0).any():
+            raise KeyError("pairs refer to ids that are not in the children / parents frames")
+        n = len(child_pos)
+        jaccard = np.zeros((len(BLOCKS), n), dtype=np.float64)
+        lenmatches = np.zeros((len(BLOCKS), n), dtype=np.int64)
+        matches = np.empty((len(BLOCKS), n), dtype=object) if with_matches else None
+
+        order = np.argsort(child_pos, kind='stable')
+        bounds = np.flatnonzero(np.diff(child_pos[order])) + 1
+        for group in np.split(order, bounds) if n else ():
+            texts = self.child_texts[child_pos[group[0]]]
+            # per prepared text: term -> term in text
+            memos = ({}, {}, {})
+            for i in group:
+                terms = self.parent_terms[parent_pos[i]]
+                for b, block in enumerate(BLOCKS):
+                    content = texts[_CONTENT[block]]
+                    if content is None or terms[b] is None:
+                        if with_matches:
+                            matches[b, i] = {''}
+                        continue
+                    distinct, size = terms[b]
+                    memo = memos[_CONTENT[block]]
+                    found = []
+                    for term in distinct:
+                        hit = memo.get(term)
+                        if hit is None:
+                            hit = memo[term] = term in content
+                        if hit:
+                            found.append(term)
+                    jaccard[b, i] = len(found) / size
+                    lenmatches[b, i] = len(found)
+                    if with_matches:
+                        matches[b, i] = set(found)
+
+        result = {}
+        for b, block in enumerate(BLOCKS):
+            result[f"{block}_jaccard"] = jaccard[b]
+            result[f"{block}_lenmatches"] = lenmatches[b]
+            if with_matches:
+                result[f"{block}_matches"] = matches[b]
+        return result
+
+    def frame(self, child_ids, parent_ids, with_matches=False):
+        '''compute() as a DataFrame in feature_columns order, one row per pair'''
+        return pd.DataFrame(self.compute(child_ids, parent_ids, with_matches),
+                            columns=feature_columns(with_matches))
+
+
+def jac_total(features):
+    '''Sum of the five jaccard columns, as in trainset2.py'''
+    return sum(features[f"{block}_jaccard"] for block in BLOCKS)
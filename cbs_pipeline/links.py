@@ -0,0 +1,150 @@
+"""
+CBS link index: normalised URL -> parent ids, for the 'match without model' shortcut.
+
+trainset2.py finds the www.cbs.nl/ token of a child with find_link (row by row), pairs the child
+with every parent and runs recordlinkage's Jaro-Winkler (threshold 0.93) between that token and
+the parents' link column, only to find out which parent the article cites. Here every parent link
+is normalised once (lower case, no scheme, no www., no query / fragment, no trailing slash or
+punctuation) into a dict, the links of all children are pulled out with one vectorised regex, and
+resolving a child is a dict lookup. Jaro-Winkler >= 0.93 also accepts near-identical URLs; the
+normalisation takes care of the differences that actually occur (http vs https, www, trailing
+slash, a closing bracket or full stop glued to the link).
+
+    index = build_link_index(open_parents())                # saved in data/parents_links
+    resolved = index.resolve_store(open_children())       # child_id, cbs_link, parent_id
+"""
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.config import parents_links_dir
+
+# a space-separated token containing www.cbs.nl/, like the split(' ') loop of find_link
+LINK_RE = re.compile(r'[^ ]*www\.cbs\.nl/[^ ]*')
+_BRACKETS = str.maketrans('', '', '()')
+_SCHEME = re.compile(r'^[^a-z0-9]*(?:https?://)?(?:www\.)?')
+_QUERY = re.compile(r'[?#].*$')
+_TAIL = re.compile(r'[/.,;:!\'"()\[\]<>]+$')
+
+
+def normalize_url(url):
+    '''
+    'https://www.cbs.nl/nl-nl/nieuws/2019/12/x/' and '(www.cbs.nl/nl-nl/nieuws/2019/12/x).'
+    both give 'cbs.nl/nl-nl/nieuws/2019/12/x'. None for empty / non-string input.
+    '''
+    if not isinstance(url, str):
+        return None
+    url = _SCHEME.sub('', url.strip().lower())
+    url = _TAIL.sub('', _QUERY.sub('', url))
+    return url or None
+
+
+def extract_links(contents):
+    '''
+    find_link for a whole column: the last www.cbs.nl/ token of every content with its
+    brackets removed, '' when there is none (NaN content too).
+    '''
+    contents = pd.Series(contents)
+    found = contents.str.replace('- ', '-', regex=False).str.findall(LINK_RE)
+    return found.map(lambda links: links[-1].translate(_BRACKETS) if isinstance(links, list) and links else '')
+
+
+class LinkIndex:
+    '''
+    urls: sorted normalised parent links, urls[i] owns parent_ids[indptr[i]:indptr[i + 1]]
+    (a link shared by several parents keeps all of them). Lookups go through a dict.
+    '''
+
+    def __init__(self, urls, indptr, parent_ids):
+        self.urls = urls
+        self.indptr = indptr
+        self.parent_ids = parent_ids
+        self.slots = {url: i for i, url in enumerate(urls.tolist())}
+
+    @classmethod
+    def build(cls, parent_ids, links):
+        pairs = pd.DataFrame({'url': [normalize_url(link) for link in links],
+                              'parent_id': np.asarray(parent_ids, dtype=np.int64)})
+        pairs = pairs.dropna().drop_duplicates().sort_values(['url', 'parent_id'], kind='stable')
+        urls, starts = np.unique(pairs['url'].to_numpy(dtype=str), return_index=True)
+        indptr = np.append(starts, len(pairs)).astype(np.int64)
+        return cls(urls, indptr, pairs['parent_id'].to_numpy(np.int64))
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        return cls(*(np.load(path / (name + '.npy')) for name in ('urls', 'indptr', 'parent_ids')))
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ('urls', 'indptr', 'parent_ids'):
+            tmp = path / (name + '.tmp.npy')
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, path / (name + '.npy'))
+        return path
+
+    def __len__(self):
+        return len(self.urls)
+
+    def parents_for(self, link):
+        '''All parent ids whose link normalises to the same URL as link'''
+        i = self.slots.get(normalize_url(link))
+        if i is None:
+            return self.parent_ids[:0]
+        return self.parent_ids[self.indptr[i]:self.indptr[i + 1]]
+
+    def resolve(self, links):
+        '''
+        First (lowest) parent id for every link, -1 where there is no link or no parent with it.
+        Returns (parent ids, number of parents with that link).
+        '''
+        slots = np.array([self.slots.get(normalize_url(link), -1) for link in links], dtype=np.int64)
+        found = slots >= 0
+        parent = np.full(len(slots), -1, dtype=np.int64)
+        count = np.zeros(len(slots), dtype=np.int64)
+        parent[found] = self.parent_ids[self.indptr[slots[found]]]
+        count[found] = self.indptr[slots[found] + 1] - self.indptr[slots[found]]
+        return parent, count
+
+    def resolve_contents(self, child_ids, contents):
+        '''
+        DataFrame (child_id, cbs_link, parent_id, n_parents) for the children whose content
+        cites a known CBS URL; these are matched without scoring or a model.
+        '''
+        links = extract_links(contents).to_numpy(dtype=object)
+        parent, count = self.resolve(links)
+        keep = parent >= 0
+        return pd.DataFrame({'child_id': np.asarray(child_ids, dtype=np.int64)[keep], 'cbs_link': links[keep],
+                             'parent_id': parent[keep], 'n_parents': count[keep]})
+
+    def resolve_store(self, children, column='content', chunk_size=50_000):
+        '''resolve_contents for every child in a CorpusStore, chunk by chunk'''
+        ids = np.asarray(children.ids, dtype=np.int64)
+        frames = [self.resolve_contents(ids[s:s + chunk_size], children.gather(ids[s:s + chunk_size], column)[column])
+                  for s in range(0, len(ids), chunk_size)]
+        if not frames:
+            return self.resolve_contents([], [])
+        return pd.concat(frames, ignore_index=True)
+
+
+def build_link_index(parents, output_dir=None, column='link'):
+    '''Index the link column of a parents CorpusStore and save it (default: data/parents_links)'''
+    output_dir = Path(output_dir or Path(parents.path).parent / parents_links_dir)
+    ids = np.asarray(parents.ids, dtype=np.int64)
+    index = LinkIndex.build(ids, parents.gather(ids, column)[column])
+    index.save(output_dir)
+    print(f"Success! {len(index)} distinct CBS links over {len(index.parent_ids)} parents in {output_dir.name}.")
+    return index
+
+
+def ensure_link_index(parents, output_dir=None):
+    '''Load the saved index, (re)building it when the parents store is newer'''
+    output_dir = Path(output_dir or Path(parents.path).parent / parents_links_dir)
+    urls = output_dir / 'urls.npy'
+    if not urls.exists() or os.path.getmtime(urls) < os.path.getmtime(parents.path):
+        return build_link_index(parents, output_dir)
+    return LinkIndex.load(output_dir)
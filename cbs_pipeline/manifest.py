@@ -0,0 +1,110 @@
+"""
+File manifest for incremental stitching.
+
+For every ingested file we keep its name, size, mtime and a sha1 of the bytes, plus the
+ids it contributed to the master output. On a rerun only files that are new, or whose
+size/mtime changed, get opened again; a file that was only touched (same sha1) is
+recorded and skipped. Files that are gone since the last run are found with missing().
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import pandas as pd
+
+MANIFEST_COLUMNS = ['path', 'size', 'mtime_ns', 'sha1', 'ids']
+
+
+def file_digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def stat_files(paths):
+    '''
+    size and mtime for every path, keyed on the file name (the data dir moves between laptops).
+    '''
+    rows = []
+    for path in paths:
+        st = os.stat(path)
+        rows.append((os.path.basename(path), st.st_size, st.st_mtime_ns))
+    return pd.DataFrame(rows, columns=['path', 'size', 'mtime_ns'])
+
+
+def join_ids(ids):
+    return ' '.join(str(int(i)) for i in ids)
+
+
+def split_ids(ids):
+    if not isinstance(ids, str) or not ids:
+        return []
+    return [int(i) for i in ids.split(' ')]
+
+
+class Manifest:
+    '''
+    One row per ingested file: path (file name), size, mtime_ns, sha1, ids (space separated).
+    '''
+
+    def __init__(self, df=None):
+        if df is None:
+            df = pd.DataFrame(columns=MANIFEST_COLUMNS)
+        self.df = df[MANIFEST_COLUMNS].set_index('path', drop=False)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        return cls(pd.read_parquet(path))
+
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_name(path.name + '.tmp')
+        df = self.df.reset_index(drop=True).astype({'size': 'int64', 'mtime_ns': 'int64'})
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, name):
+        return name in self.df.index
+
+    def sha1(self, name):
+        return self.df.at[name, 'sha1'] if name in self.df.index else None
+
+    def ids(self, name):
+        return split_ids(self.df.at[name, 'ids']) if name in self.df.index else []
+
+    def candidates(self, paths):
+        '''
+        The paths that have to be read again: not in the manifest yet, or size/mtime changed.
+        '''
+        stats = stat_files(paths)
+        stats['full_path'] = [str(p) for p in paths]
+        known = stats.merge(self.df[['size', 'mtime_ns']].reset_index(), on='path', how='left',
+                            suffixes=('', '_known'))
+        changed = (known['size'] != known['size_known']) | (known['mtime_ns'] != known['mtime_ns_known'])
+        return known.loc[changed, 'full_path'].tolist()
+
+    def missing(self, paths):
+        '''Names in the manifest without a file among paths (deleted since the last run)'''
+        names = {os.path.basename(p) for p in paths}
+        return [name for name in self.df.index if name not in names]
+
+    def sharing(self, ids, exclude=()):
+        '''Names of the files, other than exclude, that hold one of the ids'''
+        ids = set(ids)
+        rest = self.df[~self.df.index.isin(exclude)]
+        return [name for name, file_ids in rest['ids'].items() if not ids.isdisjoint(split_ids(file_ids))]
+
+    def remove(self, names):
+        self.df = self.df[~self.df.index.isin(names)]
+
+    def update(self, records):
+        '''Insert or overwrite rows, records are dicts with the MANIFEST_COLUMNS keys'''
+        if not records:
+            return
+        new = pd.DataFrame(records, columns=MANIFEST_COLUMNS).drop_duplicates('path', keep='last')
+        rest = self.df[~self.df.index.isin(new['path'])]
+        self.df = pd.concat([rest, new.set_index('path', drop=False)], axis=0)
@@ -0,0 +1,116 @@
+"""
+Sorted (child, parent) pair index over full_matches with the legacy '%' score.
+
+The last cell of new_preprocess.ipynb used to read trainset_reconstructed.csv again, do a
+full pd.merge against full_matches.csv just to attach '%', and write the whole trainset
+back. Here every (child_id, parent_id) pair is packed into one int64 key
+(child << 32 | parent), the keys are sorted and stored next to a float32 score column as
+.npy files. Looking up '%' for any batch of pairs is then one np.searchsorted.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.config import data_dir, matches_file, match_index_dir
+from cbs_pipeline.stitch import stitch_matches
+
+_MAX_ID = 1 << 32
+
+
+def pair_keys(child_ids, parent_ids):
+    '''(child << 32) | parent as int64; ids have to fit in 32 bits'''
+    c = np.asarray(child_ids, dtype=np.int64)
+    p = np.asarray(parent_ids, dtype=np.int64)
+    if len(c) and (c.min() < 0 or p.min() < 0 or c.max() >= _MAX_ID or p.max() >= _MAX_ID):
+        raise ValueError("ids must be between 0 and 2**32 to be packed into a pair key")
+    return (c << 32) | p
+
+
+class MatchIndex:
+    '''
+    keys: sorted int64 pair keys, scores: float32 '%' per key.
+    A pair that shows up several times (different legacy runs) keeps its highest score.
+    '''
+
+    def __init__(self, keys, scores):
+        self.keys = keys
+        self.scores = scores
+
+    @classmethod
+    def from_pairs(cls, child_ids, parent_ids, scores):
+        keys = pair_keys(child_ids, parent_ids)
+        scores = np.asarray(pd.to_numeric(pd.Series(scores), errors='coerce').fillna(0), dtype=np.float32)
+        # sort on key, highest score first, then keep the first row of every key
+        order = np.lexsort((-scores, keys))
+        keys, scores = keys[order], scores[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        return cls(keys[first], scores[first])
+
+    @classmethod
+    def from_frame(cls, full_matches):
+        df = full_matches.dropna(subset=['child_id', 'parent_id'])
+        return cls.from_pairs(df['child_id'].astype('int64'), df['parent_id'].astype('int64'), df['%'])
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = Path(path)
+        mode = 'r' if mmap else None
+        return cls(np.load(path / 'keys.npy', mmap_mode=mode), np.load(path / 'scores.npy', mmap_mode=mode))
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name, array in (('keys', self.keys), ('scores', self.scores)):
+            tmp = path / (name + '.tmp.npy')
+            np.save(tmp, array)
+            os.replace(tmp, path / (name + '.npy'))
+        return path
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def child_ids(self):
+        return self.keys >> 32
+
+    @property
+    def parent_ids(self):
+        return self.keys & (_MAX_ID - 1)
+
+    def positions(self, child_ids, parent_ids):
+        '''Position of every pair in the index, -1 when the pair is not a known match'''
+        keys = pair_keys(child_ids, parent_ids)
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[idx] == keys, idx, -1)
+
+    def contains(self, child_ids, parent_ids):
+        return self.positions(child_ids, parent_ids) >= 0
+
+    def lookup(self, child_ids, parent_ids, default=0.0):
+        '''
+        '%' for every (child_id, parent_id) pair; pairs that are not in full_matches
+        (like the random negatives) get default, same as the old fillna(0) after the merge.
+        '''
+        pos = self.positions(child_ids, parent_ids)
+        return np.where(pos >= 0, self.scores[np.maximum(pos, 0)], np.float32(default)).astype(np.float32)
+
+    def to_frame(self):
+        return pd.DataFrame({'child_id': self.child_ids, 'parent_id': self.parent_ids, '%': self.scores})
+
+
+def build_match_index(directory=data_dir, output_name=match_index_dir, incremental=True, processes=None):
+    '''
+    Stitch the *_output.csv files in parallel (only new/changed ones when incremental) into
+    full_matches.parquet and write the sorted pair index next to it.
+    '''
+    directory = Path(directory)
+    stitch_matches(directory, matches_file, incremental=incremental, processes=processes)
+    index = MatchIndex.from_frame(pd.read_parquet(directory / matches_file))
+    index.save(directory / output_name)
+    print(f"Success! Saved {output_name} with {len(index)} unique (child, parent) pairs.")
+    return index
@@ -0,0 +1,241 @@
+"""
+MinHash signatures and an LSH banding index over the legacy-cleaned parents.
+
+trainset2.py gets its candidates from recordlinkage.Index().add(Full()), every parent x every
+child, and then scores all of them. Here every parent's token-id set (tokensets.py) is summarised
+by bands * rows MinHash values; two sets agree on a MinHash value with probability equal to
+their Jaccard. Each band of `rows` values is hashed into one key, and a child only meets the
+parents it shares at least one band key with, which is a binary search per band instead of a
+pass over all parents. Estimated Jaccard = share of equal signature values.
+
+More rows per band: fewer, more similar candidates (faster, lower recall). More bands: the
+opposite. The threshold where the S-curve turns is about (1 / bands) ** (1 / rows).
+
+    index = MinHashIndex.build(legacy_tokens.sets[('parents', 'content')], bands=32, rows=4)
+    pairs = index.query(legacy_tokens.sets[('children', 'content')], child_ids, threshold=0.2)
+
+Recall vs speed against exact Jaccard:
+    python -m cbs_pipeline.minhash --field content --sample 500 --threshold 0.2
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.config import data_dir, legacy_tokens_dir, minhash_dir
+from cbs_pipeline.tokensets import LegacyTokens, batch_jaccard
+
+# h(x) = ((a * x + b) mod P) & 0xffffffff with P a prime above 2**32
+_PRIME = np.uint64(4294967311)
+_MASK = np.uint64(0xffffffff)
+# signature of an empty set, never put in a bucket
+EMPTY = np.uint32(0xffffffff)
+
+
+def hash_params(num_perm, seed=42):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+    mult = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+    return a, b, mult
+
+
+def signatures(sets, pos, a, b):
+    '''(len(pos), len(a)) uint32 MinHash signatures of rows pos of a TokenSets, EMPTY rows for empty sets'''
+    lengths, tokens = sets.rows(pos)
+    sig = np.full((len(lengths), len(a)), EMPTY, dtype=np.uint32)
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return sig
+    starts = (np.cumsum(lengths) - lengths)[nonempty]
+    x = tokens.astype(np.uint64)
+    for i in range(len(a)):
+        h = ((a[i] * x + b[i]) % _PRIME) & _MASK
+        sig[nonempty, i] = np.minimum.reduceat(h, starts)
+    return sig
+
+
+def band_keys(sig, bands, rows, mult):
+    '''(bands, n) uint64: every band of `rows` signature values hashed into one key'''
+    n = len(sig)
+    keys = np.zeros((bands, n), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for band in range(bands):
+            block = sig[:, band * rows:(band + 1) * rows].astype(np.uint64)
+            keys[band] = (block * mult[band * rows:(band + 1) * rows]).sum(axis=1) + np.uint64(band)
+    return keys
+
+
+class MinHashIndex:
+    '''
+    Parent signatures plus, per band, the band keys sorted with the parent rows they belong to.
+    Parents with an empty token set are never returned.
+    '''
+
+    def __init__(self, ids, sig, keys, order, bands, rows, seed):
+        self.ids = ids
+        self.sig = sig
+        self.keys = keys
+        self.order = order
+        self.bands = bands
+        self.rows = rows
+        self.seed = seed
+        self.a, self.b, self.mult = hash_params(bands * rows, seed)
+
+    @classmethod
+    def build(cls, parent_sets, bands=32, rows=4, seed=42, chunk_size=20_000):
+        a, b, mult = hash_params(bands * rows, seed)
+        ids = np.asarray(parent_sets.ids, dtype=np.int64)
+        sig = np.concatenate([signatures(parent_sets, np.arange(s, min(s + chunk_size, len(ids))), a, b)
+                              for s in range(0, len(ids), chunk_size)] or
+                             [np.zeros((0, bands * rows), dtype=np.uint32)])
+        keep = np.flatnonzero(sig[:, 0] != EMPTY) if len(sig) else np.zeros(0, dtype=np.int64)
+        all_keys = band_keys(sig[keep], bands, rows, mult)
+        order = np.argsort(all_keys, axis=1, kind='stable')
+        keys = np.take_along_axis(all_keys, order, axis=1)
+        return cls(ids, sig, keys, keep[order].astype(np.int32), bands, rows, seed)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = Path(path)
+        mode = 'r' if mmap else None
+        params = json.loads((path / 'params.json').read_text())
+        arrays = {name: np.load(path / (name + '.npy'), mmap_mode=mode) for name in ('ids', 'sig', 'keys', 'order')}
+        return cls(bands=params['bands'], rows=params['rows'], seed=params['seed'], **arrays)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ('ids', 'sig', 'keys', 'order'):
+            tmp = path / (name + '.tmp.npy')
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, path / (name + '.npy'))
+        (path / 'params.json').write_text(json.dumps({'bands': self.bands, 'rows': self.rows, 'seed': self.seed}))
+        return path
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_perm(self):
+        return self.bands * self.rows
+
+    def threshold(self):
+        '''Jaccard where the chance of becoming a candidate is about 50%'''
+        return (1 / self.bands) ** (1 / self.rows)
+
+    def candidates(self, sig):
+        '''
+        (query row, parent row) for every query signature row and every parent it shares a band key
+        with, duplicates removed.
+        '''
+        keys = band_keys(sig, self.bands, self.rows, self.mult)
+        nonempty = sig[:, 0] != EMPTY
+        q_rows, p_rows = [], []
+        for band in range(self.bands):
+            lo = np.searchsorted(self.keys[band], keys[band], side='left')
+            hi = np.searchsorted(self.keys[band], keys[band], side='right')
+            counts = np.where(nonempty, hi - lo, 0)
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            q = np.repeat(np.arange(len(sig)), counts)
+            ends = np.cumsum(counts)
+            offsets = np.arange(total) - np.repeat(ends - counts, counts) + np.repeat(lo, counts)
+            q_rows.append(q)
+            p_rows.append(np.asarray(self.order[band][offsets], dtype=np.int64))
+        if not q_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pairs = np.unique(np.concatenate(q_rows).astype(np.int64) << 32 | np.concatenate(p_rows))
+        return pairs >> 32, pairs & 0xffffffff
+
+    def estimate(self, q_sig, p_rows):
+        '''Estimated Jaccard: share of equal MinHash values'''
+        return (q_sig == self.sig[p_rows]).mean(axis=1)
+
+    def query(self, child_sets, child_ids, threshold=0.0, chunk_size=5_000):
+        '''
+        Candidate (child_id, parent_id, est_jaccard) pairs with est_jaccard >= threshold for all
+        child_ids (looked up in child_sets, a TokenSets over the same vocabulary).
+        '''
+        child_ids = np.asarray(child_ids, dtype=np.int64)
+        frames = []
+        for start in range(0, len(child_ids), chunk_size):
+            ids = child_ids[start:start + chunk_size]
+            sig = signatures(child_sets, child_sets.positions(ids), self.a, self.b)
+            q, p = self.candidates(sig)
+            est = self.estimate(sig[q], p)
+            keep = est >= threshold
+            frames.append(pd.DataFrame({'child_id': ids[q[keep]], 'parent_id': self.ids[p[keep]],
+                                        'est_jaccard': est[keep].astype(np.float32)}))
+        if not frames:
+            return pd.DataFrame({'child_id': [], 'parent_id': [], 'est_jaccard': []})
+        return pd.concat(frames, ignore_index=True)
+
+    def query_one(self, child_sets, child_id, threshold=0.0):
+        pairs = self.query(child_sets, [child_id], threshold)
+        return pairs.sort_values('est_jaccard', ascending=False)[['parent_id', 'est_jaccard']]
+
+
+def build_minhash(tokens, field='content', output_dir=None, bands=32, rows=4, seed=42):
+    '''Build and save the index over the parents of a LegacyTokens (default: data/parents_minhash_<field>)'''
+    output_dir = Path(output_dir or tokens.path.parent / f"{minhash_dir}_{field}")
+    index = MinHashIndex.build(tokens.sets[('parents', field)], bands, rows, seed)
+    index.save(output_dir)
+    print(f"Success! MinHash index over {len(index)} parents ({bands} bands x {rows} rows) in {output_dir.name}.")
+    return index
+
+
+def benchmark(tokens, child_ids, field='content', threshold=0.2, configs=((16, 4), (32, 4), (32, 2), (20, 5))):
+    '''
+    Recall of the LSH candidates against exact jaccard_similarity >= threshold over all
+    parents x the given children, plus candidates per child and query time.
+    '''
+    child_sets = tokens.sets[('children', field)]
+    parent_sets = tokens.sets[('parents', field)]
+    child_ids = np.asarray(child_ids, dtype=np.int64)
+    parent_ids = np.asarray(parent_sets.ids, dtype=np.int64)
+
+    start = time.perf_counter()
+    c = np.repeat(child_ids, len(parent_ids))
+    p = np.tile(parent_ids, len(child_ids))
+    exact = batch_jaccard(child_sets, parent_sets, c, p)
+    exact_seconds = time.perf_counter() - start
+    hit = exact >= threshold
+    truth = set(zip(c[hit].tolist(), p[hit].tolist()))
+
+    rows = [{'bands': 'exact', 'rows': '', 'threshold_50%': '', 'candidates_per_child': len(parent_ids),
+             'recall': 1.0, 'seconds': round(exact_seconds, 3)}]
+    for bands, r in configs:
+        index = MinHashIndex.build(parent_sets, bands, r)
+        start = time.perf_counter()
+        pairs = index.query(child_sets, child_ids)
+        seconds = time.perf_counter() - start
+        found = set(zip(pairs['child_id'].tolist(), pairs['parent_id'].tolist()))
+        rows.append({'bands': bands, 'rows': r, 'threshold_50%': round(index.threshold(), 3),
+                     'candidates_per_child': round(len(pairs) / max(len(child_ids), 1), 1),
+                     'recall': round(len(truth & found) / len(truth), 3) if truth else 1.0,
+                     'seconds': round(seconds, 3)})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall vs speed of the MinHash LSH index")
+    parser.add_argument('--data-dir', default=str(data_dir))
+    parser.add_argument('--field', default='content', help="title or content")
+    parser.add_argument('--sample', type=int, default=500, help="number of children to query")
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    tokens = LegacyTokens(Path(args.data_dir) / legacy_tokens_dir)
+    ids = tokens.sets[('children', args.field)].ids
+    sample = np.random.default_rng(42).choice(ids, min(args.sample, len(ids)), replace=False)
+    print(benchmark(tokens, sample, args.field, args.threshold).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
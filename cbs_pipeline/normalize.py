@@ -0,0 +1,178 @@
+"""
+One-pass normalization of the legacy derived text columns.
+
+preprocessing_parent and the child preprocessing in trainset2.py make five or more row-wise
+.apply passes over the same text (regex, remove_numbers, select_and_prepare_first_paragraph_
+of_CBS_article, select_and_prepare_title_of_CBS_article, remove_stopwords_from_content), and
+every one of them imports nltk, rebuilds the stopword set and runs word_tokenize again. The
+Normalizer visits every document once: one numeral scan gives the numbers and the text without
+numbers (numerals.py), every derived string is punctuation-stripped and tokenized exactly once
+with compiled patterns, and one shared stopword set filters all of them.
+
+Tokenizing: after the legacy punctuation strip (re.sub(r'[^\\w\\s]', '')) there is nothing left for
+word_tokenize to split except a handful of English contractions (cannot, gonna, ...), so a
+whitespace split plus those splits gives the same tokens.
+
+Columns (names as in the legacy code):
+    parents: parent_numbers, content_no_numbers, content_without_stopwords,
+             first_paragraph_without_stopwords, title_without_stopwords
+    children: child_numbers, content_no_numbers, title_child_no_stop, content_child_no_stop
+
+    python -m cbs_pipeline.normalize --sample 500     # benchmark against the legacy functions
+"""
+import argparse
+import importlib.util
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.config import data_dir
+from cbs_pipeline.numerals import scan
+from cbs_pipeline.taxonomy import dutch_stop_words
+
+_PUNCT = re.compile(r'[^\w\s]')
+
+# the word_tokenize splits that survive punctuation stripping (nltk CONTRACTIONS2)
+_CONTRACTIONS = {'cannot': 3, 'gimme': 3, 'gonna': 3, 'gotta': 3, 'lemme': 3, 'wanna': 3}
+
+# preprocessing_child: other references to cbs become cbs itself (literal replacements)
+CBS_REFERENCES = ['centraal bureau voor de statistiek', 'cbs(cbs)', 'cbs (cbs)', 'cbs ( cbs )']
+
+PARENT_COLUMNS = ['parent_numbers', 'content_no_numbers', 'content_without_stopwords',
+                  'first_paragraph_without_stopwords', 'title_without_stopwords']
+CHILD_COLUMNS = ['child_numbers', 'content_no_numbers', 'title_child_no_stop', 'content_child_no_stop']
+
+
+def tokenize(text):
+    '''word_tokenize(re.sub(r'[^\\w\\s]', '', text))'''
+    tokens = []
+    for token in _PUNCT.sub('', text).split():
+        cut = _CONTRACTIONS.get(token.lower())
+        if cut:
+            tokens.append(token[:cut])
+            tokens.append(token[cut:])
+        else:
+            tokens.append(token)
+    return tokens
+
+
+def prepare_parent_text(title, content):
+    '''The astype(str) / str.lower / str.replace chain of preprocessing_parent (NaN becomes 'nan' there too)'''
+    content = str(content).lower().replace('-', ' ').replace('  ', ' ')
+    return str(title).lower(), content
+
+
+def prepare_child_text(title, content):
+    '''The astype(str) / str.lower / str.replace chain of preprocessing_child'''
+    content = str(content).lower()
+    for reference in CBS_REFERENCES:
+        content = content.replace(reference, 'cbs')
+    return str(title).lower(), content
+
+
+class Normalizer:
+    '''
+    Input:
+        - stop_words: Dutch stopwords (default: nltk's list, loaded once)
+    '''
+
+    def __init__(self, stop_words=None):
+        self.stop_words = dutch_stop_words() if stop_words is None else stop_words
+
+    def _filtered(self, text):
+        if not isinstance(text, str):
+            return ''
+        stop_words = self.stop_words
+        return ' '.join(w for w in tokenize(text) if w not in stop_words)
+
+    def parent(self, title, content, prepared=False):
+        '''Every derived parent column for one article, as a tuple in PARENT_COLUMNS order'''
+        if not prepared:
+            title, content = prepare_parent_text(title, content)
+        numbers, no_numbers = scan(content)
+        first_paragraph = content.split('\n')[0] if isinstance(content, str) else np.nan
+        return (numbers, no_numbers, self._filtered(no_numbers), self._filtered(first_paragraph),
+                self._filtered(title))
+
+    def child(self, title, content, prepared=False):
+        '''Every derived child column for one article, as a tuple in CHILD_COLUMNS order'''
+        if not prepared:
+            title, content = prepare_child_text(title, content)
+        numbers, no_numbers = scan(content)
+        return numbers, no_numbers, self._filtered(title), self._filtered(no_numbers)
+
+    def parents(self, df, prepared=False):
+        '''DataFrame with the PARENT_COLUMNS for every row of df (title, content), same index'''
+        rows = [self.parent(t, c, prepared) for t, c in zip(df['title'], df['content'])]
+        return pd.DataFrame(rows, columns=PARENT_COLUMNS, index=df.index)
+
+    def children(self, df, prepared=False):
+        '''DataFrame with the CHILD_COLUMNS for every row of df (title, content), same index'''
+        rows = [self.child(t, c, prepared) for t, c in zip(df['title'], df['content'])]
+        return pd.DataFrame(rows, columns=CHILD_COLUMNS, index=df.index)
+
+
+def _legacy_functions():
+    '''final_project_functions.py from Legacy Files, for the benchmark'''
+    legacy_dir = Path(__file__).resolve().parent.parent / 'Legacy Files'
+    sys.path.insert(0, str(legacy_dir))
+    spec = importlib.util.spec_from_file_location('final_project_functions', legacy_dir / 'final_project_functions.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def benchmark(parents, normalizer=None):
+    '''
+    Seconds for the legacy .apply passes and for Normalizer.parents on the same (title, content)
+    frame, plus the number of rows where any derived column differs.
+    '''
+    legacy = _legacy_functions()
+    normalizer = normalizer or Normalizer()
+    df = parents[['title', 'content']].copy()
+    df['title'], df['content'] = zip(*(prepare_parent_text(t, c) for t, c in zip(df['title'], df['content'])))
+
+    start = time.perf_counter()
+    old = pd.DataFrame(index=df.index)
+    old['parent_numbers'] = df.apply(legacy.regex, args=('content',), axis=1)
+    old['first_paragraph_without_stopwords'] = df.apply(legacy.select_and_prepare_first_paragraph_of_CBS_article, axis=1)
+    old['title_without_stopwords'] = df.apply(legacy.select_and_prepare_title_of_CBS_article, axis=1)
+    old['content_no_numbers'] = df.apply(legacy.remove_numbers, args=('content',), axis=1)
+    old['content_without_stopwords'] = pd.concat([df, old], axis=1).apply(
+        legacy.remove_stopwords_from_content, args=('content_no_numbers',), axis=1)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = normalizer.parents(df, prepared=True)
+    new_seconds = time.perf_counter() - start
+
+    differ = np.zeros(len(df), dtype=bool)
+    for column in PARENT_COLUMNS:
+        if column == 'parent_numbers':
+            differ |= [set(a) != set(b) for a, b in zip(old[column], new[column])]
+        else:
+            differ |= ((old[column] != new[column]) & ~(old[column].isna() & new[column].isna())).to_numpy()
+    return pd.DataFrame({'rows': [len(df)] * 2, 'seconds': [round(legacy_seconds, 3), round(new_seconds, 3)],
+                         'rows_per_sec': [round(len(df) / legacy_seconds), round(len(df) / new_seconds)],
+                         'rows_differing': [0, int(differ.sum())]},
+                        index=['legacy apply passes', 'Normalizer'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Normalizer against the legacy preprocessing")
+    parser.add_argument('--data-dir', default=str(data_dir))
+    parser.add_argument('--sample', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    from cbs_pipeline.store import open_parents
+    store = open_parents(args.data_dir)
+    parents = store.gather(store.ids[:args.sample], ['title', 'content'])
+    print(benchmark(parents).to_string())
+
+
+if __name__ == '__main__':
+    main()
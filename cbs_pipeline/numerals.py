@@ -0,0 +1,206 @@
+"""
+Dutch numeral extraction in one compiled pass, plus a number -> parent ids index.
+
+The legacy regex() (final_project_functions.py) re-imports re and hands its big pattern to
+re.finditer again for every row, goes through nested try/excepts and rebuilds the 100-entry
+getal_dictionary in own_word2num for every token; remove_numbers then runs the same regex over
+the same content a second time. scan() does both in one finditer over the text with the
+pattern compiled once, and normalises every distinct match string only once (lru_cache).
+The outputs are the same as regex() (as a list of unique values in order of appearance) and
+remove_numbers().
+
+NumberIndex maps every normalised number to the parents that mention it, so the find_numbers
+overlap of a child with all parents is a few lookups instead of a pass over every pair.
+"""
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.config import parents_numbers_dir
+
+NUMBER_PATTERN = (r"\b(nul)\b|\b([a-zA-Z]*(twin|der|veer|vijf|zes|zeven|acht|negen)tig|[a-zA-Z]*tien|twee|drie|vier|vijf|zes|zeven|acht|negen|elf|twaalf)( )?(honderd|duizend|miljoen|miljard|procent)?\b|\b(honderd|duizend|miljoen|miljard)\b|\b[-+]?[.|,]?[\d]+(?:,\d\d\d)*[\.|,]?\d*([.|,]\d+)*(?:[eE][-+]?\d+)?( )?(honderd|duizend|miljoen|miljard|procent|%)?|half (miljoen|miljard|procent)")
+NUMBER_RE = re.compile(NUMBER_PATTERN)
+
+_THOUSANDS = re.compile(r"(\d{1,3}[.]){1,3}\d{3}")
+_SUFFIX = re.compile(r'honderd|duizend|miljoen|miljard|procent')
+SUFFIXES = ('honderd', 'duizend', 'miljoen', 'miljard', 'procent')
+MULTIPLIERS = {'honderd': 100, 'duizend': 1000, 'miljoen': 1000000, 'miljard': 1000000000, 'procent': 1}
+
+_UNITS = ['een', 'twee', 'drie', 'vier', 'vijf', 'zes', 'zeven', 'acht', 'negen']
+_TENS = ['twintig', 'dertig', 'veertig', 'vijftig', 'zestig', 'zeventig', 'tachtig', 'negentig']
+
+# same table as own_word2num, built once
+GETAL = {'nul': 0, 'half': 0.5}
+GETAL.update({word: i for i, word in enumerate(_UNITS, 1)})
+GETAL.update({'tien': 10, 'elf': 11, 'twaalf': 12, 'dertien': 13, 'veertien': 14, 'vijftien': 15,
+              'zestien': 16, 'zeventien': 17, 'achttien': 18, 'negentien': 19})
+for _t, _tens in enumerate(_TENS, 2):
+    GETAL[_tens] = _t * 10
+    GETAL.update({unit + 'en' + _tens: _t * 10 + i for i, unit in enumerate(_UNITS, 1)})
+GETAL.update({'honderd': 100, 'duizend': 1000, 'miljoen': 1000000, 'miljard': 1000000000, 'punt': '.'})
+
+
+def _fix_separators(string):
+    if _THOUSANDS.match(string):
+        return string.replace('.', '')
+    return string.replace(',', '.')
+
+
+@lru_cache(maxsize=100_000)
+def normalize_match(raw):
+    '''
+    One match of NUMBER_RE -> the value regex() appends for it, None when it appends nothing
+    '12,5 procent' -> '12.5 procent', 'drie miljoen' -> '3000000.0', '1.250' -> '1250'
+    '''
+    string = raw.strip().strip('.')
+    string = _fix_separators(string.replace('%', ' procent'))
+    if string.endswith(SUFFIXES):
+        endstring = _SUFFIX.search(string).group()
+        multiplier = MULTIPLIERS[endstring]
+        # if empty, only endstring was string, example honderd
+        string = _fix_separators(_SUFFIX.sub('', string))
+        if string == '':
+            return str(multiplier)
+        try:
+            value = GETAL[string.strip('.').strip()]
+            if endstring == 'procent':
+                return str(value) + ' procent'
+            return str(float(value) * multiplier)
+        except (KeyError, ValueError):
+            pass
+        string = string.strip('.').strip()
+        if endstring == 'procent':
+            return string + ' procent'
+        try:
+            return str(float(string) * multiplier)
+        except ValueError:
+            return None
+    return str(GETAL.get(string, string))
+
+
+def scan(text):
+    '''
+    (numbers, text without numbers) in one pass: the same values as regex(row) and the same
+    string as remove_numbers(row). Non-strings give ([], nan) like the legacy functions.
+    '''
+    if not isinstance(text, str):
+        return [], np.nan
+    numbers = {}
+    pieces = []
+    last = 0
+    for match in NUMBER_RE.finditer(text):
+        pieces.append(text[last:match.start()])
+        last = match.end()
+        value = normalize_match(match.group())
+        if value is not None:
+            numbers[value] = None
+    pieces.append(text[last:])
+    return list(numbers), ''.join(pieces)
+
+
+def scan_series(texts):
+    '''
+    Whole column at once. Returns a DataFrame on the same index with 'numbers' (list per row,
+    like child_numbers / parent_numbers) and 'no_numbers' (like content_no_numbers).
+    '''
+    numbers, stripped = zip(*map(scan, texts)) if len(texts) else ((), ())
+    index = texts.index if isinstance(texts, pd.Series) else None
+    return pd.DataFrame({'numbers': list(numbers), 'no_numbers': list(stripped)}, index=index)
+
+
+def extract_numbers(texts):
+    return scan_series(texts)['numbers']
+
+
+class NumberIndex:
+    '''
+    Inverted index: normalised number -> sorted parent ids that mention it.
+
+    values[i] owns parent_ids[indptr[i]:indptr[i + 1]]; parents / sizes hold the number of
+    distinct numbers of every parent (the find_numbers denominator).
+    '''
+
+    def __init__(self, values, indptr, parent_ids, parents, sizes):
+        self.values = values
+        self.indptr = indptr
+        self.parent_ids = parent_ids
+        self.parents = parents
+        self.sizes = sizes
+
+    @classmethod
+    def build(cls, parent_ids, numbers):
+        '''parent_ids and their lists of numbers (e.g. scan_series(parents['content'])['numbers'])'''
+        pairs = pd.DataFrame({'parent_id': np.asarray(parent_ids, dtype=np.int64), 'number': list(numbers)})
+        pairs = pairs.explode('number').dropna().drop_duplicates()
+        pairs['number'] = pairs['number'].astype(str)
+        pairs = pairs.sort_values(['number', 'parent_id'], kind='stable')
+        values, starts = np.unique(pairs['number'].to_numpy(dtype=str), return_index=True)
+        indptr = np.append(starts, len(pairs)).astype(np.int64)
+        sizes = pairs.groupby('parent_id').size()
+        return cls(values, indptr, pairs['parent_id'].to_numpy(np.int64),
+                   sizes.index.to_numpy(np.int64), sizes.to_numpy(np.int64))
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        return cls(*(np.load(path / (name + '.npy')) for name in ('values', 'indptr', 'parent_ids', 'parents', 'sizes')))
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ('values', 'indptr', 'parent_ids', 'parents', 'sizes'):
+            tmp = path / (name + '.tmp.npy')
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, path / (name + '.npy'))
+        return path
+
+    def __len__(self):
+        return len(self.values)
+
+    def parents_with(self, number):
+        i = np.searchsorted(self.values, number)
+        if i < len(self.values) and self.values[i] == number:
+            return self.parent_ids[self.indptr[i]:self.indptr[i + 1]]
+        return self.parent_ids[:0]
+
+    def matches(self, child_numbers):
+        '''
+        Series parent_id -> number of the child's numbers it shares, for every parent that shares one.
+        '''
+        hits = [self.parents_with(n) for n in set(child_numbers)]
+        if not hits:
+            return pd.Series(dtype=np.int64)
+        ids, counts = np.unique(np.concatenate(hits), return_counts=True)
+        return pd.Series(counts, index=ids, name='matches')
+
+    def overlap(self, child_numbers):
+        '''
+        find_numbers for one child against all parents at once: DataFrame of (matches, share)
+        per parent with at least one shared number, share = matches / distinct parent numbers.
+        find_numbers tests `x in ' '.join(child_numbers)` (substrings), this matches whole values.
+        '''
+        counts = self.matches(child_numbers)
+        sizes = self.sizes[np.searchsorted(self.parents, counts.index.to_numpy())]
+        return pd.DataFrame({'matches': counts.to_numpy(), 'share': counts.to_numpy() / sizes},
+                            index=counts.index.rename('parent_id'))
+
+
+def build_number_index(parents, output_dir=None, column='content', chunk_size=20_000):
+    '''
+    Scan the column of every parent in a CorpusStore chunk by chunk and save the NumberIndex
+    (default: data/parents_numbers next to the store).
+    '''
+    output_dir = Path(output_dir or Path(parents.path).parent / parents_numbers_dir)
+    ids = np.asarray(parents.ids, dtype=np.int64)
+    numbers = []
+    for start in range(0, len(ids), chunk_size):
+        texts = parents.gather(ids[start:start + chunk_size], column)[column]
+        numbers.extend(extract_numbers(texts))
+    index = NumberIndex.build(ids, numbers)
+    index.save(output_dir)
+    print(f"Success! {len(index)} distinct numbers over {len(index.parents)} parents in {output_dir.name}.")
+    return index
@@ -0,0 +1,213 @@
+"""
+Packed archive for the single-row article files (c_*.csv / p_*.csv).
+
+trainset2.py, model_C's load_child_text and model_C2's read_child_text open one tiny csv
+per article, so fetching 100k articles is 100k opens plus 100k pandas parses. A pack holds
+the raw csv bytes of all articles in a few large segment files plus a sorted offset index,
+so fetching article N is one binary search, one slice of a memory-mapped segment and one
+decode. Records are zlib-compressed individually (when that actually makes them smaller).
+
+Layout of a pack directory:
+    segment-00000.bin, segment-00001.bin, ...   b'CBSPACK1' followed by the records
+    index.npy                                   id, segment, flags, offset, length (sorted on id)
+"""
+import io
+import mmap
+import os
+import re
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from cbs_pipeline.config import data_dir
+from cbs_pipeline.stitch import list_article_files, iter_batches
+
+MAGIC = b'CBSPACK1'
+FLAG_ZLIB = 1
+INDEX_DTYPE = np.dtype([('id', '<i8'), ('segment', '<i4'), ('flags', '<i4'),
+                        ('offset', '<i8'), ('length', '<i8')])
+
+_FILE_ID = re.compile(r'^[a-z]+_(\d+)\.csv$')
+
+
+def id_from_path(path):
+    '''c_674464.csv -> 674464, None for anything else (like the *_output.csv files)'''
+    m = _FILE_ID.match(os.path.basename(path))
+    return int(m.group(1)) if m else None
+
+
+def encode_record(data, compress=True, level=6):
+    '''Returns (flags, payload); only keeps the compressed version if it is smaller'''
+    if compress:
+        packed = zlib.compress(data, level)
+        if len(packed) < len(data):
+            return FLAG_ZLIB, packed
+    return 0, data
+
+
+def decode_record(flags, payload):
+    if flags & FLAG_ZLIB:
+        return zlib.decompress(payload)
+    return bytes(payload)
+
+
+class PackWriter:
+    '''
+    Appends records to segment files of at most segment_size bytes and writes the index on close().
+    Ids that were already added are skipped (first one wins, same as the stitcher).
+    '''
+
+    def __init__(self, output_dir, segment_size=1 << 30):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.segment = -1
+        self.f = None
+        self.entries = []
+        self.seen = set()
+
+    def _next_segment(self):
+        if self.f is not None:
+            self.f.close()
+        self.segment += 1
+        self.f = open(self.output_dir / ('segment-%05d.bin' % self.segment), 'wb')
+        self.f.write(MAGIC)
+
+    def add(self, id_, flags, payload):
+        if id_ in self.seen:
+            return False
+        self.seen.add(id_)
+        if self.f is None or self.f.tell() + len(payload) > self.segment_size:
+            self._next_segment()
+        self.entries.append((id_, self.segment, flags, self.f.tell(), len(payload)))
+        self.f.write(payload)
+        return True
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+        index = np.array(self.entries, dtype=INDEX_DTYPE)
+        index = index[np.argsort(index['id'], kind='stable')]
+        np.save(self.output_dir / 'index.npy', index)
+        return len(index)
+
+
+def read_pack_batch(paths, compress=True, level=6, known_sha1=None):
+    '''
+    Worker: read and compress a batch of article files.
+    Returns ([(id, flags, payload), ...], [(path, error), ...])
+    '''
+    records = []
+    errors = []
+    for path in paths:
+        id_ = id_from_path(path)
+        if id_ is None:
+            errors.append((path, 'no article id in the file name'))
+            continue
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            errors.append((path, str(e)))
+            continue
+        records.append((id_,) + encode_record(data, compress, level))
+    return records, errors
+
+
+def pack_directory(directory=data_dir, output_dir=None, file_pattern='c_*.csv', compress=True, level=6,
+                   segment_size=1 << 30, processes=None, files_per_task=512):
+    '''
+    Convert the single-article csv files in the data dir into a pack.
+
+    Input:
+        - file_pattern: 'c_*.csv' for children (the *_output.csv files are skipped), 'p_*.csv' for parents
+        - output_dir: defaults to data/children_pack or data/parents_pack
+    Output: the pack directory. Files are read and compressed in a process pool.
+    '''
+    directory = Path(directory)
+    if output_dir is None:
+        output_dir = directory / ('children_pack' if file_pattern.startswith('c_') else 'parents_pack')
+    paths = list_article_files(file_pattern, directory)
+    print(f"Packing {len(paths)} files into {Path(output_dir).name}.")
+
+    writer = PackWriter(output_dir, segment_size)
+    errors = []
+    with tqdm(total=len(paths)) as progress:
+        for n_files, (records, batch_errors) in iter_batches(
+                paths, read_pack_batch, (compress, level), processes, files_per_task):
+            for record in records:
+                writer.add(*record)
+            errors.extend(batch_errors)
+            progress.update(n_files)
+    n = writer.close()
+    for path, error in errors[:10]:
+        print(f"Error reading {path}: {error}")
+    print(f"Success! Packed {n} articles in {writer.segment + 1} segment(s).")
+    return Path(output_dir)
+
+
+class PackReader:
+    '''
+    Random access by article id.
+
+    pack = PackReader('data/children_pack')
+    df = pack.read_frame(674464)     # same frame as pd.read_csv('data/c_674464.csv')
+    '''
+
+    def __init__(self, pack_dir):
+        self.pack_dir = Path(pack_dir)
+        self.index = np.load(self.pack_dir / 'index.npy')
+        self._segments = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id_):
+        return self._find(id_) is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def ids(self):
+        '''All article ids in the pack, sorted'''
+        return self.index['id']
+
+    def _find(self, id_):
+        i = np.searchsorted(self.index['id'], id_)
+        if i < len(self.index) and self.index['id'][i] == id_:
+            return self.index[i]
+        return None
+
+    def _segment(self, n):
+        if n not in self._segments:
+            with open(self.pack_dir / ('segment-%05d.bin' % n), 'rb') as f:
+                self._segments[n] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._segments[n]
+
+    def read_bytes(self, id_):
+        '''
+        The original csv bytes of an article.
+        Raises FileNotFoundError for unknown ids, so `except OSError` around pd.read_csv keeps working.
+        '''
+        entry = self._find(int(id_))
+        if entry is None:
+            raise FileNotFoundError(f"article {id_} is not in {self.pack_dir}")
+        segment = self._segment(int(entry['segment']))
+        start = int(entry['offset'])
+        return decode_record(int(entry['flags']), segment[start:start + int(entry['length'])])
+
+    def read_frame(self, id_, **read_csv_kwargs):
+        '''Drop-in for pd.read_csv('c_%s.csv' % id_)'''
+        return pd.read_csv(io.BytesIO(self.read_bytes(id_)), **read_csv_kwargs)
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
@@ -0,0 +1,124 @@
+"""
+Vectorised negative sampling that never hands a child one of its own parents.
+
+The sampling cell of new_preprocess.ipynb loops over valid_matches.iterrows() and calls
+random.choice(all_parent_ids) until the parent differs from the current p_id. A child that is
+linked to several parents can get one of its other true parents as a "negative", and going to k
+negatives per positive means k loops per row. KnownParents keeps every child's parents as a CSR
+structure (sorted children, indptr, sorted parents per child); sample_negatives draws all
+n * k parents at once, then only redraws the ones that hit a known parent of their child or
+repeat an earlier draw for the same positive, until none are left.
+
+    known = KnownParents.from_frame(matches_df)
+    trainset = training_pairs(valid_matches['child_id'], valid_matches['parent_id'], known,
+                              parents_clean.ids, k=1, random_state=42)
+"""
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.matches import pair_keys
+
+
+class KnownParents:
+    '''
+    CSR child -> parents: children[i] has parents[indptr[i]:indptr[i + 1]] (sorted, unique).
+    '''
+
+    def __init__(self, children, indptr, parents):
+        self.children = children
+        self.indptr = indptr
+        self.parents = parents
+        # the CSR rows flattened into sorted (child << 32 | parent) keys, for membership tests
+        self.keys = pair_keys(np.repeat(children, np.diff(indptr)), parents)
+
+    @classmethod
+    def from_pairs(cls, child_ids, parent_ids):
+        keys = np.unique(pair_keys(child_ids, parent_ids))
+        child, parent = keys >> 32, keys & 0xffffffff
+        children, starts = np.unique(child, return_index=True)
+        return cls(children, np.append(starts, len(keys)).astype(np.int64), parent)
+
+    @classmethod
+    def from_frame(cls, matches):
+        '''All (child_id, parent_id) pairs of full_matches, whatever their score'''
+        df = matches.dropna(subset=['child_id', 'parent_id'])
+        return cls.from_pairs(df['child_id'].astype('int64'), df['parent_id'].astype('int64'))
+
+    def __len__(self):
+        return len(self.children)
+
+    def parents_of(self, child_id):
+        i = np.searchsorted(self.children, child_id)
+        if i < len(self.children) and self.children[i] == child_id:
+            return self.parents[self.indptr[i]:self.indptr[i + 1]]
+        return self.parents[:0]
+
+    def counts(self, child_ids):
+        '''Number of known parents of every child (0 for unknown children)'''
+        child_ids = np.asarray(child_ids, dtype=np.int64)
+        if len(self.children) == 0:
+            return np.zeros(len(child_ids), dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.children, child_ids), len(self.children) - 1)
+        return np.where(self.children[i] == child_ids, self.indptr[i + 1] - self.indptr[i], 0)
+
+    def contains(self, child_ids, parent_ids):
+        '''Boolean array: is parent a known parent of child, pair by pair'''
+        keys = pair_keys(child_ids, parent_ids)
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        i = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[i] == keys
+
+
+def _repeats(draws):
+    '''(n, k) mask of draws that equal an earlier draw in the same row'''
+    order = np.argsort(draws, axis=1, kind='stable')
+    ordered = np.take_along_axis(draws, order, axis=1)
+    dup = np.zeros(draws.shape, dtype=bool)
+    dup[:, 1:] = ordered[:, 1:] == ordered[:, :-1]
+    mask = np.zeros(draws.shape, dtype=bool)
+    np.put_along_axis(mask, order, dup, axis=1)
+    return mask
+
+
+def sample_negatives(child_ids, known, pool, k=1, random_state=42, max_rounds=100):
+    '''
+    (len(child_ids), k) int64 parent ids drawn uniformly from pool, none of them a known parent
+    of that row's child and no parent twice in one row.
+
+    Input:
+        - child_ids: the child of every positive (a child with several positives gets k per positive)
+        - known: KnownParents with every child's true parents
+        - pool: parent ids to draw from (e.g. parents_clean.ids)
+    '''
+    child_ids = np.asarray(child_ids, dtype=np.int64)
+    pool = np.unique(np.asarray(pool, dtype=np.int64))
+    if len(pool) < k:
+        raise ValueError(f"cannot draw k={k} distinct negatives from {len(pool)} parents")
+
+    rng = np.random.default_rng(random_state)
+    draws = pool[rng.integers(0, len(pool), (len(child_ids), k))]
+    children = np.repeat(child_ids[:, None], k, axis=1)
+    bad = known.contains(children.ravel(), draws.ravel()).reshape(draws.shape) | _repeats(draws)
+    for _ in range(max_rounds):
+        n_bad = int(bad.sum())
+        if n_bad == 0:
+            return draws
+        draws[bad] = pool[rng.integers(0, len(pool), n_bad)]
+        bad = known.contains(children.ravel(), draws.ravel()).reshape(draws.shape) | _repeats(draws)
+    raise RuntimeError(f"{int(bad.sum())} negatives still collide after {max_rounds} rounds")
+
+
+def training_pairs(child_ids, parent_ids, known, pool, k=1, random_state=42):
+    '''
+    The trainset frame: every positive (child_id, parent_id, match=1) followed by its k
+    negatives (match=0), in the order of the positives.
+    '''
+    child_ids = np.asarray(child_ids, dtype=np.int64)
+    parent_ids = np.asarray(parent_ids, dtype=np.int64)
+    negatives = sample_negatives(child_ids, known, pool, k, random_state)
+    return pd.DataFrame({
+        'child_id': np.repeat(child_ids, k + 1),
+        'parent_id': np.column_stack([parent_ids, negatives]).ravel(),
+        'match': np.tile(np.r_[1, np.zeros(k, dtype=np.int64)], len(child_ids)),
+    })
@@ -0,0 +1,116 @@
+"""
+Compact dtype profile for the children and parents frames.
+
+full_children carries ~100 columns (see the column list in Legacy Files/trainset2.py) and
+everything used to come in as object dtype, with ids going through
+pd.to_numeric(...).fillna(-1).astype(int). load_corpus applies an explicit schema instead:
+int64 ids, downcast numbers, categoricals for the low-cardinality publisher/source/medium
+columns, parsed (tz-naive) datetimes, Arrow-backed strings for the long text and interned
+Python strings for the short, very repetitive ones. memory_report shows what each column costs.
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.store import CorpusStore
+
+ID_COLUMNS = ['id', '_version_']
+
+DATETIME_COLUMNS = ['publish_date', 'publish_date_date', 'insert_date', 'insert_date_date']
+
+NUMBER_COLUMNS = ['reach', 'mom_2019_impact_score', 'mom_impact_score', 'media_value', 'surface',
+                  'circulation', 'reproductions', 'duration', 'word_count', 'page',
+                  'publish_day', 'publish_week', 'publish_month', 'publish_year',
+                  'publish_hour', 'publish_minute']
+
+CATEGORY_COLUMNS = ['datasource_title', 'datasource_type_title', 'datasource_key', 'datasource_type_key',
+                    'datasource_theme', 'datasource_theme_string', 'publisher', 'publisher_string',
+                    'medium', 'medium_string', 'medium_category', 'medium_category_string',
+                    'medium_subcategory', 'medium_subcategory_string', 'source', 'source_string',
+                    'edition', 'edition_string', 'section', 'section_string',
+                    'publication', 'publication_string', 'publication_issue', 'publication_issue_string',
+                    'program', 'program_string', 'themes', 'themes_string', 'departments',
+                    'departments_string', 'subject', 'subject_string', 'series', 'series_string',
+                    'press_conference', 'press_conference_string', 'copyright', 'publish_weekday',
+                    'phenomenon', 'regional_data', 'gatekeeper_key', 'embargo', 'graphic', 'video']
+
+INTERNED_COLUMNS = ['authors', 'authors_string', 'tags', 'tags_string', 'taxonomies', 'taxonomies_string',
+                    'spokesmen', 'spokesmen_string']
+
+# everything else (title, content, links, related_parents, ...) becomes an Arrow-backed string
+SCHEMA = {}
+SCHEMA.update({c: 'id' for c in ID_COLUMNS})
+SCHEMA.update({c: 'datetime' for c in DATETIME_COLUMNS})
+SCHEMA.update({c: 'number' for c in NUMBER_COLUMNS})
+SCHEMA.update({c: 'category' for c in CATEGORY_COLUMNS})
+SCHEMA.update({c: 'interned' for c in INTERNED_COLUMNS})
+
+
+def to_id(s):
+    return pd.to_numeric(s, errors='coerce').astype('Int64' if s.isna().any() else 'int64')
+
+
+def to_number(s):
+    '''Smallest dtype that holds the values: int8..int64 when all whole numbers, float32 otherwise'''
+    s = pd.to_numeric(s, errors='coerce')
+    if s.notna().all() and len(s) and np.all(np.mod(s, 1) == 0):
+        return pd.to_numeric(s.astype('int64'), downcast='integer')
+    return s.astype('float32')
+
+
+def to_datetime(s):
+    return pd.to_datetime(s, errors='coerce', utc=True).dt.tz_localize(None)
+
+
+def to_interned(s):
+    return s.map(lambda x: sys.intern(x) if isinstance(x, str) else x).astype(object)
+
+
+CONVERTERS = {
+    'id': to_id,
+    'number': to_number,
+    'datetime': to_datetime,
+    'category': lambda s: s.astype('category'),
+    'interned': to_interned,
+    'string': lambda s: s.astype('string[pyarrow]'),
+}
+
+
+def apply_schema(df, schema=None):
+    '''Convert every column of df according to the schema (unknown columns become strings)'''
+    schema = SCHEMA if schema is None else schema
+    return pd.DataFrame({c: CONVERTERS[schema.get(c, 'string')](df[c]) for c in df.columns}, index=df.index)
+
+
+def load_corpus(source, columns=None, schema=None, index='id'):
+    '''
+    Load (selected columns of) a stitched corpus with the compact dtypes.
+
+    Input:
+        - source: the stitched parquet output (data/full_children.parquet) or an .arrow store
+        - columns: only these columns (the id column is always included)
+        - index: column to use as index, None to keep it as a column
+    '''
+    source = Path(source)
+    if columns is not None and index and index not in columns:
+        columns = [index] + list(columns)
+    if source.suffix == '.arrow':
+        df = CorpusStore(source).frame(columns)
+    else:
+        df = pd.read_parquet(source, columns=columns)
+    df = apply_schema(df, schema)
+    return df.set_index(index) if index else df
+
+
+def memory_report(df):
+    '''Per-column dtype and deep memory use, biggest first, with a TOTAL row at the bottom'''
+    usage = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({'dtype': df.dtypes.astype(str), 'bytes': usage})
+    report = report.sort_values('bytes', ascending=False)
+    report['MB'] = (report['bytes'] / 2**20).round(2)
+    report['share'] = (report['bytes'] / max(report['bytes'].sum(), 1)).round(3)
+    total = pd.DataFrame({'dtype': [''], 'bytes': [report['bytes'].sum()],
+                          'MB': [round(report['bytes'].sum() / 2**20, 2)], 'share': [1.0]}, index=['TOTAL'])
+    return pd.concat([report, total])
@@ -0,0 +1,208 @@
+"""
+Vectorized pair scoring for the reconstructed trainset features.
+
+trainset_reconstructed.csv used to come out of a c.similarity(p) loop, a jaccard_similarity
+list comprehension and separate date cells that parsed publish_date for every pair again.
+score_pairs takes arrays of child ids and parent ids and returns all six features in one
+chunked pass:
+
+    title_sim_dutch, content_sim_dutch      cosine of the precomputed doc vectors (vectors.py)
+    title_sim_legacy, content_sim_legacy    Jaccard of the stemmed token sets (tokensets.py)
+    days_diff, date_binary                  |child - parent| publish date in days, <= 2
+
+Publish dates are parsed once per article, not once per pair. With processes > 1 the chunks
+are scored in a process pool; every worker memory-maps the same stores and vector files.
+groups=['legacy'] (see FEATURE_GROUPS) scores only those features, so a changed input does not
+cost the spaCy-vector ones too.
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from cbs_pipeline.config import (data_dir, children_clean_store, parents_clean_store, children_vectors,
+                                 parents_vectors, legacy_tokens_dir)
+from cbs_pipeline.store import CorpusStore
+from cbs_pipeline.tokensets import LegacyTokens
+from cbs_pipeline.vectors import DocVectors, pair_similarity
+
+# features that come out of the same inputs, and are recomputed together
+FEATURE_GROUPS = {
+    'dutch': ['title_sim_dutch', 'content_sim_dutch'],
+    'legacy': ['title_sim_legacy', 'content_sim_legacy'],
+    'dates': ['days_diff', 'date_binary'],
+}
+FEATURES = [f for columns in FEATURE_GROUPS.values() for f in columns]
+
+# legacy logic was a window of 2 days
+DATE_WINDOW = 2
+
+
+def parse_dates(values):
+    '''Same parsing as the date cell: errors become NaT, timezones are dropped (wall time kept)'''
+    dates = pd.to_datetime(pd.Series(values), errors='coerce')
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_localize(None)
+    return dates.values.astype('datetime64[ns]')
+
+
+def article_dates(store, column='publish_date'):
+    '''Parsed publish date of every article, aligned to store.ids'''
+    return parse_dates(store.gather(store.ids, column)[column])
+
+
+def batch_jaccard(left, right, left_ids, right_ids):
+    '''
+    jaccard_similarity per pair for two aligned lists of legacy-cleaned strings. The token
+    set of an article is built once per batch, even when it is in many pairs.
+    Only used when there are no precomputed LegacyTokens.
+    '''
+    sets = {}
+    out = np.zeros(len(left), dtype=np.float64)
+    for i, (l, r, li, ri) in enumerate(zip(left, right, left_ids, right_ids)):
+        a = sets.get(('l', li))
+        if a is None:
+            a = sets[('l', li)] = set(l.split())
+        b = sets.get(('r', ri))
+        if b is None:
+            b = sets[('r', ri)] = set(r.split())
+        if a and b:
+            c = len(a & b)
+            out[i] = c / (len(a) + len(b) - c)
+    return out
+
+
+class PairScorer:
+    '''
+    Scores (child_id, parent_id) pairs against the cleaned stores and doc vectors.
+    With tokens (LegacyTokens) the legacy Jaccard is computed on the token-id sets instead of
+    splitting the cleaned strings.
+
+    scorer = PairScorer.open(data_path)
+    features = scorer.score(trainset['child_id'], trainset['parent_id'])
+    '''
+
+    def __init__(self, children_clean, parents_clean, children_vecs, parents_vecs, tokens=None):
+        self.children = children_clean
+        self.parents = parents_clean
+        self.children_vecs = children_vecs
+        self.parents_vecs = parents_vecs
+        self.tokens = tokens
+        self._dates = {}
+
+    @classmethod
+    def open(cls, directory=data_dir):
+        directory = Path(directory)
+        tokens = directory / legacy_tokens_dir
+        return cls.from_paths(directory / children_clean_store, directory / parents_clean_store,
+                              directory / children_vectors, directory / parents_vectors,
+                              tokens if tokens.exists() else None)
+
+    @classmethod
+    def from_paths(cls, children_clean, parents_clean, children_vecs, parents_vecs, tokens=None):
+        return cls(CorpusStore(children_clean), CorpusStore(parents_clean),
+                   DocVectors(children_vecs), DocVectors(parents_vecs),
+                   LegacyTokens(tokens) if tokens else None)
+
+    @property
+    def paths(self):
+        return (self.children.path, self.parents.path, self.children_vecs.path, self.parents_vecs.path,
+                self.tokens.path if self.tokens else None)
+
+    def dates(self, side):
+        if side not in self._dates:
+            self._dates[side] = article_dates(self.children if side == 'child' else self.parents)
+        return self._dates[side]
+
+    def _gather_dates(self, side, ids):
+        store = self.children if side == 'child' else self.parents
+        if len(store.ids) == 0:
+            return np.full(len(ids), np.datetime64('NaT'), dtype='datetime64[ns]')
+        pos = np.minimum(np.searchsorted(store.ids, ids), len(store.ids) - 1)
+        return np.where(store.ids[pos] == ids, self.dates(side)[pos], np.datetime64('NaT'))
+
+    def score(self, child_ids, parent_ids, groups=None):
+        '''DataFrame with the features of groups (default: all FEATURES), one row per pair (same order)'''
+        child_ids = np.asarray(child_ids, dtype=np.int64)
+        parent_ids = np.asarray(parent_ids, dtype=np.int64)
+        groups = FEATURE_GROUPS if groups is None else groups
+        out = pd.DataFrame(index=range(len(child_ids)))
+        if 'dutch' in groups:
+            for field in ('title', 'content'):
+                out[field + '_sim_dutch'] = pair_similarity(self.children_vecs, self.parents_vecs,
+                                                            child_ids, parent_ids, field)
+
+        if 'legacy' in groups and self.tokens is not None:
+            out['title_sim_legacy'] = self.tokens.jaccard(child_ids, parent_ids, 'title')
+            out['content_sim_legacy'] = self.tokens.jaccard(child_ids, parent_ids, 'content')
+        elif 'legacy' in groups:
+            columns = ['clean_title_legacy', 'clean_content_legacy']
+            c_text = self.children.gather(child_ids, columns, fill='')
+            p_text = self.parents.gather(parent_ids, columns, fill='')
+            out['title_sim_legacy'] = batch_jaccard(c_text['clean_title_legacy'], p_text['clean_title_legacy'],
+                                                    child_ids, parent_ids)
+            out['content_sim_legacy'] = batch_jaccard(c_text['clean_content_legacy'],
+                                                      p_text['clean_content_legacy'], child_ids, parent_ids)
+
+        if 'dates' in groups:
+            diff = self._gather_dates('child', child_ids) - self._gather_dates('parent', parent_ids)
+            out['days_diff'] = np.abs(diff / np.timedelta64(1, 'D'))
+            out['date_binary'] = (out['days_diff'] <= DATE_WINDOW).astype(int)
+        return out
+
+
+_worker_scorers = {}
+
+
+def _score_chunk(paths, child_ids, parent_ids, groups):
+    # one scorer per worker process, the stores and vectors are memory-mapped
+    if paths not in _worker_scorers:
+        _worker_scorers[paths] = PairScorer.from_paths(*paths)
+    return _worker_scorers[paths].score(child_ids, parent_ids, groups)
+
+
+def score_pairs(child_ids, parent_ids, scorer=None, directory=data_dir, chunk_size=200_000, processes=1,
+                groups=None):
+    '''
+    All six trainset features (or those of groups) for millions of pairs.
+
+    Input:
+        - child_ids, parent_ids: aligned arrays (e.g. trainset['child_id'], trainset['parent_id'])
+        - scorer: a PairScorer, or None to open the cleaned stores / vectors in directory
+        - processes: > 1 scores the chunks in a process pool
+        - groups: names from FEATURE_GROUPS, default all
+    Output: DataFrame with the FEATURES columns (of groups), aligned to the input pairs
+    '''
+    child_ids = np.asarray(child_ids, dtype=np.int64)
+    parent_ids = np.asarray(parent_ids, dtype=np.int64)
+    scorer = scorer or PairScorer.open(directory)
+    groups = list(FEATURE_GROUPS if groups is None else groups)
+    columns = [f for g in groups for f in FEATURE_GROUPS[g]]
+    starts = range(0, len(child_ids), chunk_size)
+    parts = []
+    if processes == 1:
+        for start in tqdm(starts):
+            end = start + chunk_size
+            parts.append(scorer.score(child_ids[start:end], parent_ids[start:end], groups))
+    else:
+        processes = processes or os.cpu_count() or 1
+        paths = tuple(str(p) if p else None for p in scorer.paths)
+        with ProcessPoolExecutor(processes) as pool, tqdm(total=len(starts)) as progress:
+            pending = deque()
+            for start in starts:
+                end = start + chunk_size
+                pending.append(pool.submit(_score_chunk, paths, child_ids[start:end], parent_ids[start:end],
+                                           groups))
+                if len(pending) >= 2 * processes:
+                    parts.append(pending.popleft().result())
+                    progress.update(1)
+            while pending:
+                parts.append(pending.popleft().result())
+                progress.update(1)
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns]
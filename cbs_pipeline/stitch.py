@@ -0,0 +1,591 @@
+"""
+Parallel streaming file stitcher, replaces build_master_csv from new_preprocess.ipynb.
+
+build_master_csv read the 350k c_*.csv / p_*.csv files one after another, kept all of
+them in df_list and only then did one giant concat + drop_duplicates. Here a process
+pool reads the files in batches, the main process drops ids it has already seen and
+streams the rows into parquet in fixed-size row groups. Peak memory is a few row
+groups plus the set of seen ids, no matter how big the corpus gets.
+
+The master output is a directory of part files (full_children.parquet/part-00000.parquet,
+...), pd.read_parquet reads it like a single file. Every ingested file is recorded in a
+manifest (see manifest.py), so a rerun only reads new or changed files: new rows go into
+a new part and only the old parts holding replaced ids get rewritten.
+"""
+import csv
+import glob
+import io
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from cbs_pipeline.config import data_dir, children_file, parents_file, matches_file, all_parents_file
+from cbs_pipeline.manifest import Manifest, file_digest, join_ids, split_ids
+
+
+def list_article_files(file_pattern, directory=data_dir):
+    '''
+    All files matching the pattern, minus the legacy *_output.csv match files.
+    Sorted, so "first one wins" deduplication is the same on every machine.
+    '''
+    files = glob.glob(str(Path(directory) / file_pattern))
+    return sorted(f for f in files if not f.endswith('_output.csv'))
+
+
+def manifest_path(output_path):
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + '.manifest')
+
+
+def read_header(path):
+    '''Only the first line of a csv, much cheaper than pd.read_csv'''
+    try:
+        with open(path, newline='', encoding='utf-8') as f:
+            return next(csv.reader(f), [])
+    except (OSError, UnicodeDecodeError, csv.Error):
+        return []
+
+
+def _keep_column(column):
+    # 'Unnamed: 0' is the old pandas index that got written into all_parents.csv
+    return column != '' and not column.startswith('Unnamed:')
+
+
+def scan_columns(paths, processes=None, chunksize=512):
+    '''
+    Union of the csv headers (in first-seen order), so every row group gets the same schema.
+    '''
+    columns = {}
+    with ProcessPoolExecutor(processes) as pool:
+        for header in pool.map(read_header, paths, chunksize=chunksize):
+            for column in header:
+                if _keep_column(column):
+                    columns.setdefault(column, None)
+    return list(columns)
+
+
+def conform_frame(df, columns, id_column='id'):
+    '''
+    Give a raw frame the stitched layout: int64 id first, every other column as string (or None).
+    Rows without a usable id are dropped, they can never be looked up anyway.
+    Returns (frame, number of dropped rows)
+    '''
+    df = df.reindex(columns=columns)
+    ids = pd.to_numeric(df[id_column], errors='coerce')
+    bad = ids.isna()
+    df = df.loc[~bad]
+    df = df.astype(object).where(df.notna(), None)
+    df[id_column] = ids.loc[~bad].astype('int64')
+    return df.reset_index(drop=True), int(bad.sum())
+
+
+def read_file(path, known_sha1=None):
+    '''
+    Read the bytes of one file and describe it for the manifest.
+    Returns (record, bytes), bytes is None when the sha1 equals known_sha1 (only touched).
+    '''
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    record = {'path': os.path.basename(path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+              'sha1': file_digest(data), 'ids': ''}
+    if known_sha1 is not None and record['sha1'] == known_sha1:
+        return record, None
+    return record, data
+
+
+def read_batch(paths, columns, id_column='id', known_sha1=None):
+    '''
+    Worker: read a batch of single-article csv files into one conformed frame.
+    known_sha1 maps file names to the sha1 in the manifest; files that did not change are not parsed.
+    Returns (frame, dropped rows, [(path, error), ...], manifest records of changed files, unchanged records)
+    '''
+    known_sha1 = known_sha1 or {}
+    frames = []
+    errors = []
+    records = []
+    unchanged = []
+    for path in paths:
+        try:
+            record, data = read_file(path, known_sha1.get(os.path.basename(path)))
+            if data is None:
+                unchanged.append(record)
+                continue
+            df = pd.read_csv(io.BytesIO(data), dtype=str)
+        except Exception as e:
+            errors.append((path, str(e)))
+            continue
+        if id_column in df.columns:
+            record['ids'] = join_ids(pd.to_numeric(df[id_column], errors='coerce').dropna())
+        frames.append(df)
+        records.append(record)
+    if frames:
+        df = pd.concat(frames, axis=0, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=columns)
+    df, dropped = conform_frame(df, columns, id_column)
+    return df, dropped, errors, records, unchanged
+
+
+def iter_batches(paths, func, args=(), processes=None, files_per_task=256, max_pending=None, known_sha1=None):
+    '''
+    Run func(batch_of_paths, *args, known_sha1) in a process pool and yield (n_files, result) in file order.
+    At most max_pending batches are in flight, so a slow writer can't make results pile up.
+    '''
+    processes = processes or os.cpu_count() or 1
+    max_pending = max_pending or 2 * processes
+    known_sha1 = known_sha1 or {}
+    tasks = [paths[i:i + files_per_task] for i in range(0, len(paths), files_per_task)]
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        for task in tasks:
+            task_sha1 = {n: known_sha1[n] for n in map(os.path.basename, task) if n in known_sha1}
+            pending.append((len(task), pool.submit(func, task, *args, task_sha1)))
+            if len(pending) >= max_pending:
+                n, future = pending.popleft()
+                yield n, future.result()
+        while pending:
+            n, future = pending.popleft()
+            yield n, future.result()
+
+
+def arrow_schema(columns, id_column='id'):
+    return pa.schema([pa.field(c, pa.int64() if c == id_column else pa.string()) for c in columns])
+
+
+def list_parts(output_dir):
+    return sorted(Path(output_dir).glob('part-*.parquet'))
+
+
+class StitchWriter:
+    '''
+    Takes conformed frames, drops ids in `seen` (first one wins, like drop_duplicates) and
+    writes parquet row groups of row_group_size rows into part files of at most part_rows rows.
+    Parts are written as .tmp and renamed when complete; abort() removes everything it wrote.
+    '''
+
+    def __init__(self, output_dir, columns, id_column='id', row_group_size=20_000,
+                 part_rows=100_000, first_part=0, seen=None):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.id_column = id_column
+        self.columns = [id_column] + [c for c in columns if c != id_column]
+        self.schema = arrow_schema(self.columns, id_column)
+        self.row_group_size = row_group_size
+        self.part_rows = part_rows
+        self.next_part = first_part
+        self.seen = set() if seen is None else seen
+        self.buffer = []
+        self.buffered_rows = 0
+        self.rows = 0
+        self.duplicates = 0
+        self.parts = []
+        self.writer = None
+        self.part_path = None
+        self.rows_in_part = 0
+
+    def add(self, df):
+        keep = []
+        for i in df[self.id_column].tolist():
+            if i in self.seen:
+                keep.append(False)
+            else:
+                self.seen.add(i)
+                keep.append(True)
+        self.duplicates += len(keep) - sum(keep)
+        df = df.loc[keep, self.columns]
+        if len(df):
+            self.buffer.append(df)
+            self.buffered_rows += len(df)
+        while self.buffered_rows >= self.row_group_size:
+            self._flush(self.row_group_size)
+
+    def _open_part(self):
+        self.part_path = self.output_dir / ('part-%05d.parquet' % self.next_part)
+        self.next_part += 1
+        self.writer = pq.ParquetWriter(self.part_path.with_name(self.part_path.name + '.tmp'), self.schema)
+        self.rows_in_part = 0
+
+    def _close_part(self):
+        self.writer.close()
+        os.replace(self.part_path.with_name(self.part_path.name + '.tmp'), self.part_path)
+        self.parts.append(self.part_path)
+        self.writer = None
+
+    def _flush(self, n_rows):
+        df = pd.concat(self.buffer, axis=0, ignore_index=True)
+        out, rest = df.iloc[:n_rows], df.iloc[n_rows:]
+        if self.writer is None:
+            self._open_part()
+        self.writer.write_table(pa.Table.from_pandas(out, schema=self.schema, preserve_index=False))
+        self.rows += len(out)
+        self.rows_in_part += len(out)
+        if self.rows_in_part >= self.part_rows:
+            self._close_part()
+        self.buffer = [rest] if len(rest) else []
+        self.buffered_rows = len(rest)
+
+    def close(self):
+        if self.buffered_rows:
+            self._flush(self.buffered_rows)
+        if self.writer is not None:
+            self._close_part()
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.part_path.with_name(self.part_path.name + '.tmp').unlink(missing_ok=True)
+        for part in self.parts:
+            part.unlink(missing_ok=True)
+
+
+def drop_ids_from_parts(parts, ids, id_column='id'):
+    '''
+    Rewrite only the parts that hold one of the ids, without those rows.
+    Returns the number of rows removed.
+    '''
+    ids = pa.array(sorted(ids), type=pa.int64())
+    removed = 0
+    for part in parts:
+        part_ids = pq.read_table(part, columns=[id_column])[id_column]
+        if not pc.any(pc.is_in(part_ids, value_set=ids)).as_py():
+            continue
+        metadata = pq.ParquetFile(part).metadata
+        row_group_size = metadata.row_group(0).num_rows if metadata.num_row_groups else None
+        table = pq.read_table(part)
+        filtered = table.filter(pc.invert(pc.is_in(table[id_column], value_set=ids)))
+        removed += table.num_rows - filtered.num_rows
+        tmp = part.with_name(part.name + '.tmp')
+        pq.write_table(filtered, tmp, row_group_size=row_group_size)
+        os.replace(tmp, part)
+    return removed
+
+
+def _stitch_into(writer, paths, id_column, processes, files_per_task, manifest, leading_csv=None):
+    '''
+    Stream (the leading csv and) the paths into the writer.
+    Changed files (sha1 differs from the manifest) replace the rows of their old ids.
+    Returns (dropped rows, errors, ids to remove from the old parts)
+    '''
+    dropped = 0
+    errors = []
+    replaced = set()
+    records = []
+    if leading_csv:
+        record, data = read_file(leading_csv)
+        for chunk in pd.read_csv(io.BytesIO(data), dtype=str, chunksize=writer.row_group_size):
+            chunk, n_dropped = conform_frame(chunk, writer.columns, id_column)
+            dropped += n_dropped
+            writer.add(chunk)
+        records.append(record)
+
+    known_sha1 = manifest.df['sha1'].to_dict()
+    with tqdm(total=len(paths)) as progress:
+        for n_files, (df, n_dropped, batch_errors, batch_records, unchanged) in iter_batches(
+                paths, read_batch, (writer.columns, id_column), processes, files_per_task,
+                known_sha1=known_sha1):
+            for record in batch_records:
+                if record['path'] in manifest:
+                    # new version of a file we already had: its old and new ids get replaced
+                    for i in manifest.ids(record['path']) + [int(i) for i in record['ids'].split()]:
+                        writer.seen.discard(i)
+                        replaced.add(i)
+            for record in unchanged:
+                record['ids'] = manifest.df.at[record['path'], 'ids']
+            dropped += n_dropped
+            errors.extend(batch_errors)
+            records.extend(batch_records)
+            records.extend(unchanged)
+            writer.add(df)
+            progress.update(n_files)
+    manifest.update(records)
+    return dropped, errors, replaced
+
+
+def stitch_files(paths, output_path, id_column='id', columns=None, leading_csv=None,
+                 processes=None, files_per_task=256, row_group_size=20_000, part_rows=100_000):
+    '''
+    Stitch many single-article csv files into a parquet dataset, from scratch.
+
+    Input:
+        - paths: the csv files, read in this order
+        - output_path: the dataset directory (e.g. data/full_children.parquet)
+        - columns: output columns, scanned from the headers when None
+        - leading_csv: an aggregate csv (all_parents.csv) that is streamed in before the
+          single files, so its rows win the deduplication like in the old notebook cell
+    Output: dict with files / rows / duplicates / dropped (no usable id) / errors
+    Writes the manifest next to the output, so update_files can pick up from here.
+    '''
+    output_path = Path(output_path)
+    if columns is None:
+        columns = scan_columns(([leading_csv] if leading_csv else []) + list(paths), processes)
+    if id_column not in columns:
+        columns = [id_column] + list(columns)
+
+    tmp_dir = output_path.with_name(output_path.name + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    writer = StitchWriter(tmp_dir, columns, id_column, row_group_size, part_rows)
+    manifest = Manifest()
+    try:
+        dropped, errors, _ = _stitch_into(writer, paths, id_column, processes, files_per_task,
+                                          manifest, leading_csv)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if output_path.is_dir():
+        shutil.rmtree(output_path)
+    elif output_path.exists():
+        output_path.unlink()
+    os.replace(tmp_dir, output_path)
+    manifest.save(manifest_path(output_path))
+
+    for path, error in errors[:10]:
+        print(f"Error reading {path}: {error}")
+    return {'files': len(paths), 'rows': writer.rows, 'duplicates': writer.duplicates,
+            'dropped': dropped, 'errors': errors}
+
+
+def update_files(paths, output_path, id_column='id', leading_csv=None, processes=None,
+                 files_per_task=256, row_group_size=20_000, part_rows=100_000):
+    '''
+    Incremental version of stitch_files: only reads files that are new or changed since the last run.
+
+    New rows go into a new part. A changed file replaces the rows of its ids, which means only
+    the old parts holding those ids get rewritten. The rows of a deleted file are dropped as well,
+    and the remaining files that also hold one of its ids are read again so those ids keep a row.
+    Falls back to a full stitch_files when there is no previous output/manifest, or when the
+    leading csv (all_parents.csv) changed or files were deleted next to it (its ids are not in the
+    manifest, so we can't tell which rows are its own).
+    Columns that were not in the existing schema are dropped.
+    '''
+    output_path = Path(output_path)
+    manifest = Manifest.load(manifest_path(output_path))
+    parts = list_parts(output_path) if output_path.is_dir() else []
+    leading_changed = bool(leading_csv) and bool(manifest.candidates([leading_csv]))
+    deleted = manifest.missing(list(paths) + ([leading_csv] if leading_csv else []))
+    if not parts or len(manifest) == 0 or leading_changed or (deleted and leading_csv):
+        return stitch_files(paths, output_path, id_column, leading_csv=leading_csv, processes=processes,
+                            files_per_task=files_per_task, row_group_size=row_group_size, part_rows=part_rows)
+
+    todo = manifest.candidates(paths)
+    gone = set()
+    if deleted:
+        for name in deleted:
+            gone.update(manifest.ids(name))
+        # files that lost an id to a deleted one: read them again as new files, seen keeps
+        # their other ids out
+        reread = set(manifest.sharing(gone, exclude=deleted))
+        manifest.remove(deleted + sorted(reread))
+        names = reread | {os.path.basename(p) for p in todo}
+        todo = [p for p in paths if os.path.basename(p) in names]
+    print(f"{len(todo)} of {len(paths)} files are new or changed, {len(deleted)} deleted.")
+    if not todo and not deleted:
+        return {'files': 0, 'rows': 0, 'duplicates': 0, 'dropped': 0, 'replaced': 0, 'deleted': 0, 'errors': []}
+
+    columns = pq.read_schema(parts[0]).names
+    seen = set(pd.read_parquet(output_path, columns=[id_column])[id_column].tolist()) - gone
+    first_part = int(parts[-1].stem.split('-')[1]) + 1
+    writer = StitchWriter(output_path, columns, id_column, row_group_size, part_rows, first_part, seen)
+    try:
+        dropped, errors, replaced = _stitch_into(writer, todo, id_column, processes, files_per_task, manifest)
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+    replaced |= gone
+    removed = drop_ids_from_parts(parts, replaced, id_column) if replaced else 0
+    manifest.save(manifest_path(output_path))
+
+    for path, error in errors[:10]:
+        print(f"Error reading {path}: {error}")
+    return {'files': len(todo), 'rows': writer.rows, 'duplicates': writer.duplicates,
+            'dropped': dropped, 'replaced': removed, 'deleted': len(deleted), 'errors': errors}
+
+
+def stitch_children(directory=data_dir, output_name=children_file, incremental=True, **kwargs):
+    '''Build (or update) full_children from every c_*.csv (not the *_output.csv files).'''
+    directory = Path(directory)
+    paths = list_article_files("c_*.csv", directory)
+    print(f"Found {len(paths)} files. Stitching them into {output_name}.")
+    stitch = update_files if incremental else stitch_files
+    summary = stitch(paths, directory / output_name, **kwargs)
+    print(f"Success! Added {summary['rows']} rows to {output_name}.")
+    return summary
+
+
+def stitch_parents(directory=data_dir, output_name=parents_file, incremental=True, **kwargs):
+    '''Build (or update) full_parents from all_parents.csv plus the individual p_*.csv files.'''
+    directory = Path(directory)
+    paths = list_article_files("p_*.csv", directory)
+    leading = directory / all_parents_file
+    leading = leading if leading.exists() else None
+    print(f"Found {len(paths)} individual parent files.")
+    stitch = update_files if incremental else stitch_files
+    summary = stitch(paths, directory / output_name, leading_csv=leading, **kwargs)
+    print(f"Success! Added {summary['rows']} rows to {output_name}.")
+    return summary
+
+
+def read_match_batch(paths, known_sha1=None):
+    '''
+    Worker: read a batch of *_output.csv files (only c, p and %).
+    Returns (frame, [(path, error), ...], manifest records of changed files, unchanged records)
+    '''
+    known_sha1 = known_sha1 or {}
+    frames = []
+    errors = []
+    records = []
+    unchanged = []
+    for path in paths:
+        try:
+            record, data = read_file(path, known_sha1.get(os.path.basename(path)))
+            if data is None:
+                unchanged.append(record)
+                continue
+            df = pd.read_csv(io.BytesIO(data), usecols=['c', 'p', '%'])
+        except Exception as e:
+            # empty file or missing columns
+            errors.append((path, str(e)))
+            continue
+        df = df.rename(columns={'c': 'child_id', 'p': 'parent_id'})
+        record['ids'] = join_ids(pd.to_numeric(df['child_id'], errors='coerce').dropna().unique())
+        frames.append(df)
+        records.append(record)
+    df = pd.concat(frames, axis=0, ignore_index=True) if frames else pd.DataFrame(columns=['child_id', 'parent_id', '%'])
+    return df, errors, records, unchanged
+
+
+MATCH_SCHEMA = pa.schema([pa.field('child_id', pa.int64()), pa.field('parent_id', pa.int64()),
+                          pa.field('%', pa.float64())])
+
+
+def _conform_matches(df):
+    '''int64 child_id / parent_id, float %; rows without usable ids are dropped, like conform_frame'''
+    df = df.reindex(columns=MATCH_SCHEMA.names)
+    for column in MATCH_SCHEMA.names:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    df = df.dropna(subset=['child_id', 'parent_id']).astype({'child_id': 'int64', 'parent_id': 'int64'})
+    return df.drop_duplicates().reset_index(drop=True)
+
+
+def _write_match_parts(df, output_dir, first_part=0, part_rows=1_000_000):
+    '''Write df as part-XXXXX.parquet files of at most part_rows rows, returns the new parts'''
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    parts = []
+    for n, start in enumerate(range(0, len(df), part_rows)):
+        part = output_dir / ('part-%05d.parquet' % (first_part + n))
+        tmp = part.with_name(part.name + '.tmp')
+        pq.write_table(pa.Table.from_pandas(df.iloc[start:start + part_rows], schema=MATCH_SCHEMA,
+                                            preserve_index=False), tmp)
+        os.replace(tmp, part)
+        parts.append(part)
+    return parts
+
+
+def stitch_matches(directory=data_dir, output_name=matches_file, incremental=True, processes=None,
+                   files_per_task=512, part_rows=1_000_000):
+    '''
+    Build (or update) full_matches.parquet from the *_output.csv files.
+
+    Like full_children, the output is a directory of part files plus a manifest. Every output file
+    belongs to one child, so a changed file replaces all rows of that child: an incremental run
+    writes the rows of the new/changed files into a new part and only rewrites the old parts that
+    hold a replaced child, so its cost follows the number of changed files, not the history.
+    The children of a deleted file are dropped; the remaining files that also hold one of them are
+    read again for just those children.
+    Output: dict with files / rows / replaced (old rows removed) / deleted / errors
+    '''
+    directory = Path(directory)
+    output_path = directory / output_name
+    paths = sorted(glob.glob(str(directory / "*_output.csv")))
+    manifest = Manifest.load(manifest_path(output_path))
+    parts = list_parts(output_path) if output_path.is_dir() else []
+    full = not incremental or not parts or len(manifest) == 0
+    if full:
+        manifest = Manifest()
+    todo = paths if full else manifest.candidates(paths)
+    deleted = [] if full else manifest.missing(paths)
+    print(f"Found {len(paths)} match files, {len(todo)} new or changed, {len(deleted)} deleted. "
+          f"Stitching them into {output_name}.")
+    if not todo and not deleted:
+        return {'files': 0, 'rows': 0, 'replaced': 0, 'deleted': 0, 'errors': []}
+
+    frames = []
+    errors = []
+    replaced = set()
+    if deleted:
+        for name in deleted:
+            replaced.update(manifest.ids(name))
+        manifest.remove(deleted)
+        todo_names = {os.path.basename(p) for p in todo}
+        reread = set(manifest.sharing(replaced, exclude=todo_names))
+        reread = [p for p in paths if os.path.basename(p) in reread]
+        gone = set(replaced)
+        for _, (df, batch_errors, _, _) in iter_batches(reread, read_match_batch, (), processes, files_per_task):
+            df = _conform_matches(df)
+            frames.append(df[df['child_id'].isin(gone)])
+            errors.extend(batch_errors)
+    records = []
+    parsed = []
+    known_sha1 = manifest.df['sha1'].to_dict()
+    with tqdm(total=len(todo)) as progress:
+        for n_files, (df, batch_errors, batch_records, unchanged) in iter_batches(
+                todo, read_match_batch, (), processes, files_per_task, known_sha1=known_sha1):
+            for record in batch_records:
+                if record['path'] in manifest:
+                    replaced.update(manifest.ids(record['path']))
+            for record in unchanged:
+                record['ids'] = manifest.df.at[record['path'], 'ids']
+            frames.append(df)
+            errors.extend(batch_errors)
+            parsed.extend(record['path'] for record in batch_records)
+            records.extend(batch_records)
+            records.extend(unchanged)
+            progress.update(n_files)
+
+    new = _conform_matches(pd.concat(frames, axis=0, ignore_index=True) if frames else pd.DataFrame())
+    removed = 0
+    if full:
+        tmp_dir = output_path.with_name(output_path.name + '.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        _write_match_parts(new, tmp_dir, part_rows=part_rows)
+        if output_path.is_dir():
+            shutil.rmtree(output_path)
+        elif output_path.exists():
+            output_path.unlink()
+        os.replace(tmp_dir, output_path)
+    else:
+        removed = drop_ids_from_parts(parts, replaced, 'child_id') if replaced else 0
+        # children of new files that are also in other files: skip rows that are already stored
+        # (the full rebuild drops those duplicates as well)
+        stored = set()
+        for ids in manifest.df.loc[~manifest.df.index.isin(parsed), 'ids']:
+            stored.update(split_ids(ids))
+        overlap = sorted((set(new['child_id'].tolist()) & stored) - replaced)
+        if overlap:
+            old = pq.read_table(output_path, filters=[('child_id', 'in', overlap)]).to_pandas()
+            old = _conform_matches(old)
+            new = new.merge(old, how='left', indicator=True)
+            new = new[new['_merge'] == 'left_only'].drop(columns='_merge').reset_index(drop=True)
+        first_part = int(parts[-1].stem.split('-')[1]) + 1
+        _write_match_parts(new, output_path, first_part, part_rows)
+    manifest.update(records)
+    manifest.save(manifest_path(output_path))
+
+    for path, error in errors[:10]:
+        print(f"Error reading {path}: {error}")
+    print(f"Success! Added {len(new)} rows (including scores) to {output_name}, replaced {removed}.")
+    return {'files': len(todo), 'rows': len(new), 'replaced': removed, 'deleted': len(deleted), 'errors': errors}
@@ -0,0 +1,153 @@
+"""
+Id-indexed columnar corpus store.
+
+The scoring cells used to look text up with `children_df.at[cid, ...] if cid in children_df.index`,
+one pair at a time, on a frame that held the whole corpus. A store is an uncompressed Arrow IPC
+(Feather v2) file that gets memory-mapped: opening it costs nothing, only the pages of the
+columns you actually touch are read from disk, and gather() looks up a whole array of ids at
+once with a binary search over the sorted ids.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cbs_pipeline.config import data_dir, children_file, parents_file, children_store, parents_store
+
+
+class CorpusStore:
+    '''
+    Memory-mapped Arrow file keyed on an int64 id column.
+
+    store = CorpusStore('data/full_children.arrow')
+    store.gather(child_ids, ['title', 'content'])   # one row per requested id, same order
+    '''
+
+    def __init__(self, path, id_column='id'):
+        self.path = Path(path)
+        self.id_column = id_column
+        self.table = pa.ipc.open_file(pa.memory_map(str(self.path), 'r')).read_all()
+        ids = self.table[id_column].to_numpy()
+        self.order = np.argsort(ids, kind='stable')
+        self.sorted_ids = ids[self.order]
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __contains__(self, id_):
+        return bool(self.contains([id_])[0])
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    @property
+    def ids(self):
+        '''All ids, sorted'''
+        return self.sorted_ids
+
+    def positions(self, ids):
+        '''Row number of every id, -1 for ids that are not in the store'''
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        idx = np.searchsorted(self.sorted_ids, ids)
+        idx = np.minimum(idx, len(self.sorted_ids) - 1)
+        found = self.sorted_ids[idx] == ids
+        return np.where(found, self.order[idx], -1)
+
+    def contains(self, ids):
+        '''Boolean array, vectorized version of `cid in children_df.index`'''
+        return self.positions(ids) >= 0
+
+    def column(self, name):
+        '''Zero-copy view on one column (pyarrow ChunkedArray)'''
+        return self.table[name]
+
+    def gather(self, ids, columns, fill=None):
+        '''
+        Look up many ids in one call.
+        Returns a DataFrame with one row per requested id (same order, duplicates allowed).
+        Unknown ids give nulls; fill replaces nulls (use '' to mimic the old fillna('') frames).
+        '''
+        if isinstance(columns, str):
+            columns = [columns]
+        pos = self.positions(ids)
+        missing = pos < 0
+        indices = pa.array(np.where(missing, 0, pos), type=pa.int64(), mask=missing)
+        df = self.table.select(columns).take(indices).to_pandas()
+        if fill is not None:
+            df = df.fillna(fill)
+        return df
+
+    def frame(self, columns=None):
+        '''The selected columns as a regular DataFrame (replacement for read_csv(usecols=...))'''
+        table = self.table if columns is None else self.table.select(columns)
+        return table.to_pandas()
+
+
+def _parquet_files(source):
+    source = Path(source)
+    if source.is_dir():
+        return sorted(source.glob('*.parquet'))
+    return [source]
+
+
+def build_store(source, output, columns=None, id_column='id', batch_size=20_000):
+    '''
+    Convert a stitched parquet output (file or part directory) into a store, batch by batch,
+    so memory stays bounded by batch_size rows.
+    '''
+    output = Path(output)
+    files = _parquet_files(source)
+    schema = pq.read_schema(files[0])
+    if columns is not None:
+        columns = [id_column] + [c for c in columns if c != id_column]
+        schema = pa.schema([schema.field(c) for c in columns])
+    tmp = output.with_name(output.name + '.tmp')
+    with pa.OSFile(str(tmp), 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for f in files:
+            for batch in pq.ParquetFile(f).iter_batches(batch_size=batch_size, columns=schema.names):
+                writer.write_batch(batch)
+    os.replace(tmp, output)
+    return output
+
+
+def write_store(df, output, id_column='id'):
+    '''
+    Write a DataFrame (e.g. the cleaned columns) as a store. An index named id_column is
+    turned back into a column.
+    '''
+    output = Path(output)
+    if id_column not in df.columns and df.index.name == id_column:
+        df = df.reset_index()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp = output.with_name(output.name + '.tmp')
+    with pa.OSFile(str(tmp), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, output)
+    return output
+
+
+def ensure_store(source, output, columns=None, id_column='id'):
+    '''
+    Open the store, (re)building it first when the parquet source is newer than it.
+    '''
+    output = Path(output)
+    newest = max(os.path.getmtime(f) for f in _parquet_files(source))
+    if not output.exists() or os.path.getmtime(output) < newest:
+        print(f"Building {output.name} from {Path(source).name}.")
+        build_store(source, output, columns, id_column)
+    return CorpusStore(output, id_column)
+
+
+def open_children(directory=data_dir):
+    directory = Path(directory)
+    return ensure_store(directory / children_file, directory / children_store)
+
+
+def open_parents(directory=data_dir):
+    directory = Path(directory)
+    return ensure_store(directory / parents_file, directory / parents_store)
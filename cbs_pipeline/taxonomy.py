@@ -0,0 +1,366 @@
+"""
+Aho-Corasick matcher for the CBS taxonomy features (sleutelwoorden / GEBRUIK+UF and BT/TT).
+
+The legacy path is slow on every level: find_synoniemen does a taxonomie_df.loc lookup per
+column per term and rebuilds the Dutch stopword set for every row, preprocessing_parent reads
+taxonomie_df.csv again on every call, and find_sleutelwoorden_UF / find_BT_TT test
+`x in content` term by term. TaxonomyMatcher loads the taxonomy once, expands every distinct
+taxonomies string once, and compiles every category name plus every word of every category's
+GEBRUIK/UF and BT/TT expansion into one Aho-Corasick automaton. One scan over a child text
+gives all terms that occur in it (as substrings, like `x in content`), so the features for
+that child against any number of parents are set lookups. The values are the same as those of
+the legacy functions, quirks included (see sleutelwoorden_terms).
+
+The taxonomy itself: parse_taxonomy_dump reads the alphabetic list dump line by line into
+plain dicts (process_taxonomie_database grows a DataFrame cell by cell, which is quadratic),
+save_taxonomy writes it as a small Arrow file and load_taxonomy reads that (or the old csv)
+once per process.
+
+    python -m cbs_pipeline.taxonomy cbs-taxonomie-alfabetische-lijst.txt --csv data/taxonomie_df.csv
+
+    matcher = TaxonomyMatcher.from_file()                # data/taxonomie.arrow or data/taxonomie_df.csv
+    matcher.expand('werkloosheid,inkomen')          # (Gebruik_UF, BT_TT) like find_synoniemen
+    matcher.match_groups(child_content)             # category -> group -> matched terms
+    matcher.pair_features(children_text, parents_taxonomies, child_ids, parent_ids)
+"""
+import argparse
+import os
+import re
+from collections import deque
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cbs_pipeline.config import data_dir, taxonomy_file, taxonomy_store
+
+# taxonomie_df columns that find_synoniemen uses, per group
+GROUPS = {
+    'GEBRUIK_UF': ('GEBRUIK', 'UF'),
+    'BT_TT': ('TT', 'BT'),
+}
+# placeholder for empty cells written by process_taxonomie.py
+_EMPTY = {'999', '999.0', ''}
+_PUNCT = re.compile(r'[^\w\s]')
+
+
+# all relation columns kept by process_taxonomie.py, in its order
+RELATIONS = ['GEBRUIK', 'TT', 'UF', 'BT', 'RT', 'CBS English', 'NT', 'Historische notitie', 'Scope notitie']
+
+
+def _cell(value):
+    if not isinstance(value, str) or value in _EMPTY:
+        return None
+    return value
+
+
+def parse_taxonomy_dump(path, header_lines=8):
+    '''
+    Streaming version of process_taxonomie_database: read the alphabetic list
+    (cbs-taxonomie-alfabetische-lijst.txt) line by line into plain dicts.
+
+    A line without a leading tab starts a term, '\tCOLUMN: value' lines add relations to it;
+    a second value for the same relation is put in front, comma separated, like the legacy code.
+    Output: {term: {relation: value or None}} with the RELATIONS columns
+    '''
+    taxonomy = {}
+    entry = None
+    with open(path, encoding='utf-8') as f:
+        for n, line in enumerate(f):
+            line = line.rstrip('\n')
+            if n < header_lines or not line:
+                continue
+            if not line.startswith('\t'):
+                entry = taxonomy[line] = {}
+                continue
+            parts = line.split(':')
+            column, value = parts[0][1:], parts[1][1:]
+            entry[column] = value if entry.get(column) is None else value + ', ' + entry[column]
+    return {term: {c: relations.get(c) for c in RELATIONS} for term, relations in taxonomy.items()}
+
+
+def save_taxonomy(taxonomy, path):
+    '''Write the taxonomy as an Arrow (Feather v2) file: a term column plus one string column per relation'''
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    path = Path(path)
+    terms = list(taxonomy)
+    columns = {'term': terms}
+    columns.update({c: [taxonomy[t].get(c) for t in terms] for c in RELATIONS})
+    tmp = path.with_name(path.name + '.tmp')
+    feather.write_feather(pa.table(columns), str(tmp), compression='uncompressed')
+    os.replace(tmp, path)
+    return path
+
+
+def taxonomy_frame(taxonomy):
+    '''The same DataFrame as taxonomie_df.csv after preprocessing_parent's 999 -> None (term on the index)'''
+    df = pd.DataFrame.from_dict(taxonomy, orient='index', columns=RELATIONS).astype(object)
+    return df.where(df.notna(), None)
+
+
+def write_taxonomy_csv(taxonomy, path):
+    '''
+    taxonomie_df.csv exactly as process_taxonomie.py wrote it, so the legacy functions can read
+    it: empty cells are 999 placeholders (an empty cell would be NaN there, which
+    find_synoniemen adds to a string). A column holds floats until its first value, so the
+    placeholders above that term come out as 999.0 and the ones below it as 999.
+    '''
+    df = pd.DataFrame.from_dict(taxonomy, orient='index', columns=RELATIONS).astype(object)
+    for column in RELATIONS:
+        empty = df[column].isna().to_numpy()
+        before_first = np.cumsum(~empty) == 0
+        df[column] = np.where(empty, np.where(before_first, '999.0', '999'), df[column].to_numpy())
+    df.to_csv(path, lineterminator='\r\n')
+    return path
+
+
+@lru_cache(maxsize=None)
+def _load(path, mtime):
+    path = Path(path)
+    if path.suffix == '.csv':
+        df = pd.read_csv(path, index_col=0, dtype=str, keep_default_na=False)
+        columns = [c for c in RELATIONS if c in df.columns]
+        return {term: {c: _cell(row[c]) for c in columns}
+                for term, row in zip(df.index, df[columns].to_dict('records'))}
+    import pyarrow.feather as feather
+    columns = feather.read_table(str(path)).to_pydict()
+    terms = columns.pop('term')
+    return {term: {c: _cell(columns[c][i]) for c in columns} for i, term in enumerate(terms)}
+
+
+def load_taxonomy(path=None):
+    '''
+    {term: {relation: value or None}} from the Arrow artifact (data/taxonomie.arrow) or, when
+    that does not exist, from taxonomie_df.csv (999 / 999.0 placeholders and empty cells become None).
+    Loaded once per process (until the file changes); don't modify the returned dicts.
+    '''
+    if path is None:
+        path = data_dir / taxonomy_store
+        if not path.exists():
+            path = data_dir / taxonomy_file
+    path = Path(path)
+    return _load(str(path.resolve()), os.path.getmtime(path))
+
+
+def load_taxonomie_df(path=None):
+    '''taxonomie_df as find_synoniemen expects it, for code that still wants the DataFrame'''
+    return taxonomy_frame(load_taxonomy(path))
+
+
+def dutch_stop_words():
+    from nltk.corpus import stopwords
+    return set(stopwords.words('dutch'))
+
+
+class AhoCorasick:
+    '''
+    Multi-pattern substring search. search(text) returns the ids of all patterns that occur
+    in text, in a single pass over its characters.
+    '''
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        goto = [{}]
+        out = [[]]
+        for pid, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(pid)
+
+        # breadth first, so the fail state of every parent is done before its children
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target if target != nxt else 0
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        self.goto = goto
+        self.fail = fail
+        self.out = out
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def search(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        hit_states = set()
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                hit_states.add(state)
+        return {pid for s in hit_states for pid in out[s]}
+
+
+class TaxonomyMatcher:
+    '''
+    Input:
+        - taxonomy: {category: {'GEBRUIK', 'UF', 'TT', 'BT'}} (see load_taxonomy)
+        - stop_words: Dutch stopwords (default: nltk's list, loaded once)
+        - tokenize: tokenizer for the expansions (default: nltk.tokenize.word_tokenize, like the legacy code)
+    '''
+
+    def __init__(self, taxonomy, stop_words=None, tokenize=None):
+        if stop_words is None:
+            stop_words = dutch_stop_words()
+        if tokenize is None:
+            from nltk.tokenize import word_tokenize as tokenize
+        self.taxonomy = taxonomy
+        self.stop_words = stop_words
+        self.tokenize = tokenize
+        self._expanded = {}
+
+        # term -> [(category, group)]; a category name is its own 'category' group
+        postings = {}
+        for category in taxonomy:
+            postings.setdefault(category, []).append((category, 'category'))
+            for group, words in zip(GROUPS, self.expand(category)):
+                for word in set(words.split(' ')) - {''}:
+                    postings.setdefault(word, []).append((category, group))
+        self.terms = sorted(postings)
+        self.postings = [postings[t] for t in self.terms]
+        self.term_ids = {t: i for i, t in enumerate(self.terms)}
+        self.automaton = AhoCorasick(self.terms)
+
+    @classmethod
+    def from_file(cls, path=None, **kwargs):
+        '''From the Arrow artifact or taxonomie_df.csv (see load_taxonomy)'''
+        return cls(load_taxonomy(path), **kwargs)
+
+    def expand(self, taxonomies):
+        '''
+        find_synoniemen for one taxonomies string: (Gebruik_UF, BT_TT), both space-joined
+        stopword-free tokens. Every distinct string is only expanded once.
+        '''
+        if not isinstance(taxonomies, str):
+            return '', ''
+        if taxonomies not in self._expanded:
+            parts = {group: '' for group in GROUPS}
+            for taxonomie in taxonomies.split(','):
+                entry = self.taxonomy.get(taxonomie)
+                if entry is None:
+                    continue
+                for group, columns in GROUPS.items():
+                    for column in columns:
+                        if entry[column] is not None:
+                            parts[group] = parts[group] + ' ' + entry[column]
+            self._expanded[taxonomies] = tuple(
+                ' '.join(w for w in self.tokenize(parts[group]) if w not in self.stop_words) for group in GROUPS)
+        return self._expanded[taxonomies]
+
+    def scan(self, text):
+        '''Every known term that occurs in text (substring match, one pass)'''
+        if not isinstance(text, str):
+            return set()
+        return {self.terms[i] for i in self.automaton.search(text)}
+
+    def match_groups(self, text):
+        '''category -> {group: sorted matched terms} for every category with a match in text'''
+        result = {}
+        for i in self.automaton.search(text) if isinstance(text, str) else ():
+            for category, group in self.postings[i]:
+                result.setdefault(category, {}).setdefault(group, []).append(self.terms[i])
+        for groups in result.values():
+            for terms in groups.values():
+                terms.sort()
+        return result
+
+    def _overlap(self, terms, found, content):
+        # `x in content` for every term, answered from the scan where the term is in the automaton
+        matches = {x for x in terms if (x in found if x in self.term_ids else x in content)}
+        return len(matches) / len(set(terms)), len(matches), matches
+
+    @staticmethod
+    def prepare_content(content):
+        '''What find_sleutelwoorden_UF / find_BT_TT match against: content_child_no_stop without punctuation'''
+        return _PUNCT.sub('', content) if isinstance(content, str) else None
+
+    @staticmethod
+    def sleutelwoorden_terms(taxonomies, gebruik_uf):
+        '''
+        The terms find_sleutelwoorden_UF looks for, None where it returns zeros.
+        Legacy quirk kept for parity: when Gebruik_UF is a single word it appends a list
+        instead of extending, the `x in content` test then raises and the row scores 0.
+        '''
+        if not isinstance(taxonomies, str) or not isinstance(gebruik_uf, str):
+            return None
+        words = gebruik_uf.split(' ')
+        if len(words) <= 1:
+            return None
+        return taxonomies.split(',') + words
+
+    def features(self, content, taxonomies, found=None):
+        '''
+        find_sleutelwoorden_UF and find_BT_TT for one child content (content_child_no_stop)
+        and one parent taxonomies string: ((jaccard, lenmatches, matches), (jaccard, lenmatches, matches)).
+        found: result of scan(prepare_content(content)) when it is already known.
+        '''
+        zero = (0, 0, {''})
+        content = self.prepare_content(content)
+        if content is None:
+            return zero, zero
+        if found is None:
+            found = self.scan(content)
+        gebruik_uf, bt_tt = self.expand(taxonomies)
+        terms = self.sleutelwoorden_terms(taxonomies, gebruik_uf)
+        sleutelwoorden = zero if terms is None else self._overlap(terms, found, content)
+        # BT_TT is '' for parents without taxonomies; legacy then matches the empty string (jaccard 1)
+        return sleutelwoorden, self._overlap(bt_tt.split(' '), found, content)
+
+    def pair_features(self, children_content, parents_taxonomies, child_ids, parent_ids):
+        '''
+        The sleutelwoorden_* and BT_TT_* columns of trainset2.py for many pairs.
+
+        Input:
+            - children_content: Series child id -> content_child_no_stop
+            - parents_taxonomies: Series parent id -> taxonomies string
+        Every child text is scanned once, however many parents it is paired with.
+        '''
+        scans = {}
+        rows = []
+        for cid, pid in zip(child_ids, parent_ids):
+            content = children_content.get(cid)
+            taxonomies = parents_taxonomies.get(pid)
+            if cid not in scans:
+                prepared = self.prepare_content(content)
+                scans[cid] = self.scan(prepared) if prepared is not None else set()
+            (sj, sn, sm), (bj, bn, bm) = self.features(content, taxonomies, scans[cid])
+            rows.append((sj, sn, sm, bj, bn, bm))
+        return pd.DataFrame(rows, columns=['sleutelwoorden_jaccard', 'sleutelwoorden_lenmatches',
+                                           'sleutelwoorden_matches', 'BT_TT_jaccard', 'BT_TT_lenmatches',
+                                           'BT_TT_matches'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse the CBS taxonomy dump into data/taxonomie.arrow")
+    parser.add_argument('dump', help="cbs-taxonomie-alfabetische-lijst.txt")
+    parser.add_argument('--output', default=str(data_dir / taxonomy_store))
+    parser.add_argument('--csv', help="also write the legacy taxonomie_df.csv here")
+    args = parser.parse_args(argv)
+
+    taxonomy = parse_taxonomy_dump(args.dump)
+    save_taxonomy(taxonomy, args.output)
+    if args.csv:
+        write_taxonomy_csv(taxonomy, args.csv)
+    print(f"Success! {len(taxonomy)} terms saved to {args.output}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Persistent cache for cleaned text.
+
+Every rerun of the cleaning stage used to lemmatize every title and body again, even though
+almost none of the articles changed. TextCache is a small sqlite file that maps
+(cleaner version, sha1 of the raw text) -> cleaned text. The cleaner version is a string like
+'clean_text_dutch/v1/nl_core_news_lg-3.7.0' (function version + spaCy model version), so
+bumping the Dutch cleaner or installing a new model misses only the Dutch entries and the
+legacy ones keep hitting. The file is kept under max_bytes by dropping the least recently
+used entries.
+
+cache = TextCache(data_path / 'clean_cache.sqlite')
+cleaners = default_cleaners(nlp, cache=cache)
+"""
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+
+from cbs_pipeline.config import data_dir, clean_cache_file
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key BLOB PRIMARY KEY,
+    version TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+CREATE INDEX IF NOT EXISTS entries_version ON entries (version);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+BEGIN UPDATE meta SET total = total + NEW.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+BEGIN UPDATE meta SET total = total - OLD.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS entries_resize AFTER UPDATE OF size ON entries
+BEGIN UPDATE meta SET total = total - OLD.size + NEW.size WHERE id = 0; END;
+'''
+
+# sqlite has a limit on the number of ? in one statement
+_BATCH = 500
+
+# entries deleted per statement when the cache is over max_bytes
+_EVICT_BATCH = 1000
+
+
+def text_key(version, text):
+    return hashlib.sha1(version.encode('utf-8') + b'\0' + text.encode('utf-8')).digest()
+
+
+class TextCache:
+    '''
+    Input:
+        - path: the sqlite file (created if missing)
+        - max_bytes: upper bound on the cached text; the least recently used entries go first
+    '''
+
+    def __init__(self, path=data_dir / clean_cache_file, max_bytes=4 << 30):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        # INSERT OR REPLACE only fires the delete trigger with recursive triggers on
+        self.db.execute('PRAGMA recursive_triggers=ON')
+        self.db.executescript(_SCHEMA)
+        # running total of the cached bytes, kept by the triggers; summed once for an older cache file
+        if self.db.execute('SELECT COUNT(*) FROM meta').fetchone()[0] == 0:
+            self.db.execute('INSERT INTO meta SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+            self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def size(self):
+        '''Cached bytes, from the running total (no table scan)'''
+        return self.db.execute('SELECT total FROM meta WHERE id = 0').fetchone()[0]
+
+    def get_many(self, version, texts):
+        '''Cached value per text, None where it is not cached'''
+        keys = [text_key(version, t) for t in texts]
+        found = {}
+        for i in range(0, len(keys), _BATCH):
+            batch = keys[i:i + _BATCH]
+            rows = self.db.execute('SELECT key, value FROM entries WHERE key IN (%s)' % ','.join('?' * len(batch)),
+                                   batch).fetchall()
+            found.update(rows)
+        if found:
+            now = time.time()
+            self.db.executemany('UPDATE entries SET used = ? WHERE key = ?', [(now, k) for k in found])
+            self.db.commit()
+        values = [found.get(k) for k in keys]
+        n_found = sum(v is not None for v in values)
+        self.hits += n_found
+        self.misses += len(values) - n_found
+        return values
+
+    def put_many(self, version, texts, values):
+        now = time.time()
+        rows = [(text_key(version, t), version, v, len(v.encode('utf-8')), now) for t, v in zip(texts, values)]
+        self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', rows)
+        self.db.commit()
+        self.evict()
+
+    def evict(self):
+        '''Drop least recently used entries until the cache is back under 90% of max_bytes'''
+        total = self.size
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * 0.9)
+        dropped = 0
+        # oldest _EVICT_BATCH entries at a time, straight off the `used` index, all in sqlite
+        while self.size > target:
+            n = self.db.execute('DELETE FROM entries WHERE key IN '
+                                '(SELECT key FROM entries ORDER BY used LIMIT ?)', (_EVICT_BATCH,)).rowcount
+            if n == 0:
+                break
+            dropped += n
+        self.db.commit()
+        return dropped
+
+    def purge(self, keep_versions):
+        '''Remove every entry whose cleaner version is not in keep_versions (old function/model versions)'''
+        keep_versions = list(keep_versions)
+        n = self.db.execute('DELETE FROM entries WHERE version NOT IN (%s)' % ','.join('?' * len(keep_versions)),
+                            keep_versions).rowcount
+        self.db.commit()
+        return n
+
+    def close(self):
+        self.db.close()
+
+
+class CachedCleaner:
+    '''
+    Wraps a list-of-texts cleaner (see cleaning.default_cleaners) so only texts that are not
+    in the cache get cleaned. The wrapped cleaner needs a `version` string.
+    '''
+
+    def __init__(self, cleaner, cache):
+        self.cleaner = cleaner
+        self.cache = cache
+        self.version = cleaner.version
+
+    def __call__(self, texts):
+        texts = [t if isinstance(t, str) else "" for t in texts]
+        out = self.cache.get_many(self.version, texts)
+        todo = list(dict.fromkeys(t for t, v in zip(texts, out) if v is None))
+        if todo:
+            cleaned = dict(zip(todo, self.cleaner(todo)))
+            self.cache.put_many(self.version, todo, [cleaned[t] for t in todo])
+            out = [cleaned[t] if v is None else v for t, v in zip(texts, out)]
+        return out
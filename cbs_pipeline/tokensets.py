@@ -0,0 +1,209 @@
+"""
+Legacy-cleaned title and content as sorted int32 token-id sets (CSR rows over one vocabulary).
+
+jaccard_similarity re-splits two stemmed strings and builds two Python sets for every pair.
+Here every article's clean_title_legacy / clean_content_legacy is turned into its set of token
+ids once, over a vocabulary shared by children and parents:
+
+    legacy_tokens/
+        vocab.txt                       one stem per line, line number = token id
+        children_title/ ids.npy         sorted int64 article ids
+                        indptr.npy      int64, row i is indices[indptr[i]:indptr[i + 1]]
+                        indices.npy     int32 sorted, unique token ids per row
+        children_content/, parents_title/, parents_content/
+
+The intersection sizes for a batch of pairs then come from one sort of (pair, token) keys,
+and Jaccard (or the legacy 'share of the parent words found in the child' ratio of
+find_title_no_stop) is plain array arithmetic.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from cbs_pipeline.config import data_dir, legacy_tokens_dir
+
+# field -> cleaned column it is built from
+TOKEN_FIELDS = {
+    'title': 'clean_title_legacy',
+    'content': 'clean_content_legacy',
+}
+
+
+class TokenSets:
+    '''CSR token-id sets of one side (children or parents) and one field, memory-mapped'''
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        mode = 'r' if mmap else None
+        self.ids = np.load(self.path / 'ids.npy', mmap_mode=mode)
+        self.indptr = np.load(self.path / 'indptr.npy', mmap_mode=mode)
+        self.indices = np.load(self.path / 'indices.npy', mmap_mode=mode)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def positions(self, ids):
+        '''Row of every id, -1 for unknown ids'''
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.where(self.ids[idx] == ids, idx, -1)
+
+    def rows(self, pos):
+        '''
+        (lengths, tokens) for the rows in pos: the set sizes and all token ids concatenated
+        in row order. Rows of -1 are empty sets.
+        '''
+        pos = np.asarray(pos, dtype=np.int64)
+        found = pos >= 0
+        safe = np.where(found, pos, 0)
+        starts = np.asarray(self.indptr[safe])
+        lengths = np.where(found, np.asarray(self.indptr[safe + 1]) - starts, 0)
+        total = int(lengths.sum())
+        ends = np.cumsum(lengths)
+        offsets = np.arange(total, dtype=np.int64) - np.repeat(ends - lengths, lengths) + np.repeat(starts, lengths)
+        return lengths, np.asarray(self.indices[offsets])
+
+    def row(self, id_):
+        return self.rows(self.positions([id_]))[1]
+
+
+def intersection_sizes(left, right, left_ids, right_ids):
+    '''
+    |left set & right set| per pair, plus both set sizes.
+    Every (pair, token) becomes one int64 key; a token in both sets shows up as a duplicate key
+    after sorting.
+    '''
+    l_len, l_tok = left.rows(left.positions(left_ids))
+    r_len, r_tok = right.rows(right.positions(right_ids))
+    n = len(l_len)
+    width = np.int64(max(int(l_tok.max(initial=0)), int(r_tok.max(initial=0))) + 1)
+    keys = np.concatenate([np.repeat(np.arange(n, dtype=np.int64), l_len) * width + l_tok,
+                           np.repeat(np.arange(n, dtype=np.int64), r_len) * width + r_tok])
+    keys.sort()
+    dup = keys[1:] == keys[:-1]
+    inter = np.bincount(keys[1:][dup] // width, minlength=n)
+    return inter, l_len, r_len
+
+
+def batch_jaccard(left, right, left_ids, right_ids, chunk_size=50_000):
+    '''Same values as jaccard_similarity on the legacy-cleaned strings, 0.0 when a side is empty'''
+    left_ids = np.asarray(left_ids, dtype=np.int64)
+    right_ids = np.asarray(right_ids, dtype=np.int64)
+    out = np.zeros(len(left_ids), dtype=np.float64)
+    for start in range(0, len(left_ids), chunk_size):
+        end = start + chunk_size
+        inter, a, b = intersection_sizes(left, right, left_ids[start:end], right_ids[start:end])
+        union = a + b - inter
+        out[start:end] = np.where((a > 0) & (b > 0), inter / np.maximum(union, 1), 0.0)
+    return out
+
+
+def batch_coverage(left, right, left_ids, right_ids, chunk_size=50_000):
+    '''
+    (share, count) of the right-hand words that also occur on the left, the ratio
+    find_title_no_stop / find_1st_paragraph_no_stop compute with parent words on the right.
+    Those match substrings of the child text, this matches whole tokens.
+    '''
+    left_ids = np.asarray(left_ids, dtype=np.int64)
+    right_ids = np.asarray(right_ids, dtype=np.int64)
+    share = np.zeros(len(left_ids), dtype=np.float64)
+    count = np.zeros(len(left_ids), dtype=np.int64)
+    for start in range(0, len(left_ids), chunk_size):
+        end = start + chunk_size
+        inter, a, b = intersection_sizes(left, right, left_ids[start:end], right_ids[start:end])
+        share[start:end] = np.where(b > 0, inter / np.maximum(b, 1), 0.0)
+        count[start:end] = inter
+    return share, count
+
+
+def _write_sets(output_dir, ids, indptr, indices):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    np.save(output_dir / 'ids.npy', ids)
+    np.save(output_dir / 'indptr.npy', indptr)
+    np.save(output_dir / 'indices.npy', indices)
+
+
+def build_token_sets(stores, output_dir, fields=TOKEN_FIELDS, chunk_size=20_000):
+    '''
+    Input:
+        - stores: side name -> cleaned CorpusStore, e.g. {'children': children_clean, 'parents': parents_clean}
+        - output_dir: e.g. data/legacy_tokens (written to a tmp dir first, then swapped in)
+    Output: LegacyTokens on the new directory
+    '''
+    output_dir = Path(output_dir)
+    tmp = output_dir.with_name(output_dir.name + '.tmp')
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    vocab = {}
+    for side, store in stores.items():
+        ids = np.asarray(store.ids, dtype=np.int64)
+        for field, column in fields.items():
+            lengths = np.zeros(len(ids), dtype=np.int64)
+            chunks = []
+            for start in tqdm(range(0, len(ids), chunk_size), desc=f"{side} {field}"):
+                texts = store.gather(ids[start:start + chunk_size], column, fill='')[column]
+                for i, text in enumerate(texts, start):
+                    row = np.unique(np.fromiter((vocab.setdefault(t, len(vocab)) for t in str(text).split()),
+                                                dtype=np.int32))
+                    lengths[i] = len(row)
+                    chunks.append(row)
+            indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            indices = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+            _write_sets(tmp / f"{side}_{field}", ids, indptr, indices)
+    with open(tmp / 'vocab.txt', 'w', encoding='utf-8') as f:
+        f.writelines(token + '\n' for token in vocab)
+
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    os.replace(tmp, output_dir)
+    print(f"Success! {len(vocab)} distinct stems in {output_dir.name}.")
+    return LegacyTokens(output_dir)
+
+
+class LegacyTokens:
+    '''
+    tokens = LegacyTokens('data/legacy_tokens')
+    tokens.jaccard(child_ids, parent_ids, 'title')     # title_sim_legacy
+    '''
+
+    def __init__(self, path=data_dir / legacy_tokens_dir):
+        self.path = Path(path)
+        self.sets = {}
+        for sub in sorted(p for p in self.path.iterdir() if p.is_dir()):
+            side, field = sub.name.rsplit('_', 1)
+            self.sets[(side, field)] = TokenSets(sub)
+        self._vocab = None
+
+    @property
+    def vocab(self):
+        '''token id -> stem (only read when asked for)'''
+        if self._vocab is None:
+            with open(self.path / 'vocab.txt', encoding='utf-8') as f:
+                self._vocab = f.read().split('\n')[:-1]
+        return self._vocab
+
+    def jaccard(self, child_ids, parent_ids, field, **kwargs):
+        return batch_jaccard(self.sets[('children', field)], self.sets[('parents', field)],
+                             child_ids, parent_ids, **kwargs)
+
+    def coverage(self, child_ids, parent_ids, field, **kwargs):
+        return batch_coverage(self.sets[('children', field)], self.sets[('parents', field)],
+                              child_ids, parent_ids, **kwargs)
+
+
+def ensure_token_sets(children_clean, parents_clean, output_dir=data_dir / legacy_tokens_dir, **kwargs):
+    '''Open the token sets, (re)building them first when a cleaned store is newer'''
+    output_dir = Path(output_dir)
+    vocab_file = output_dir / 'vocab.txt'
+    newest = max(os.path.getmtime(children_clean.path), os.path.getmtime(parents_clean.path))
+    if not vocab_file.exists() or os.path.getmtime(vocab_file) < newest:
+        return build_token_sets({'children': children_clean, 'parents': parents_clean}, output_dir, **kwargs)
+    return LegacyTokens(output_dir)
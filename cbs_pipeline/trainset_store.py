@@ -0,0 +1,214 @@
+"""
+Append-only, partitioned column store for the reconstructed trainset.
+
+trainset_reconstructed.csv is written as a whole every time a column changes, and every notebook
+that uses it (rf_models_reconstructed, rf_semantic_error_analysis, model_C, model_C2,
+network_graph) parses all of it again, even when it only needs child_id, parent_id, match and %.
+TrainsetStore keeps the rows in partitions and every column of a partition in its own Arrow file:
+
+    trainset_reconstructed.store/
+        _meta.json              partitions (name, rows), the column order and column versions
+        part-00000/
+            child_id.arrow
+            parent_id.arrow
+            ...
+        part-00001/ ...
+
+append() adds rows as a new partition, add_column() writes only the files of that one column
+(a new feature, or a recomputed one), and read(columns) memory-maps only the requested column
+files. _meta.json is replaced last, so a crash halfway leaves the previous state readable.
+add_column(name, values, version) also records what the column was computed from; the
+feature store (feature_store.py) uses that to recompute only the features whose inputs changed.
+
+read_trainset is the drop-in for pd.read_csv('trainset_reconstructed.csv'): it reads the store
+next to the csv name when there is one and falls back to the csv otherwise.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from cbs_pipeline.config import trainset_file, trainset_store
+
+_META = '_meta.json'
+
+
+def store_path(csv_path=trainset_file):
+    '''trainset_reconstructed.csv -> trainset_reconstructed.store'''
+    csv_path = Path(csv_path)
+    if csv_path.name == trainset_file:
+        return csv_path.with_name(trainset_store)
+    return csv_path.with_suffix('.store')
+
+
+def _column_file(name):
+    # column names like '%' or '1st_paragraph_no_stop_lenmatches' stay readable, only '/' is not allowed
+    return name.replace('/', '_') + '.arrow'
+
+
+def _write_column(path, name, values, type=None):
+    table = pa.Table.from_pandas(pd.DataFrame({name: values}), preserve_index=False)
+    if type is not None and table.schema.field(name).type != type:
+        table = table.cast(pa.schema([pa.field(name, type)]))
+    tmp = path / (_column_file(name) + '.tmp')
+    with pa.OSFile(str(tmp), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path / _column_file(name))
+
+
+def _read_column(path, name):
+    return pa.ipc.open_file(pa.memory_map(str(path / _column_file(name)), 'r')).read_all().column(0)
+
+
+def _column_type(path, name):
+    return pa.ipc.open_file(pa.memory_map(str(path / _column_file(name)), 'r')).schema.field(name).type
+
+
+class TrainsetStore:
+    '''
+    store = TrainsetStore.create('trainset_reconstructed.store', trainset_new[['child_id', 'parent_id', 'match']])
+    store.add_column('%', scores)
+    store.read(['child_id', 'parent_id', '%'])
+    '''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        meta = json.loads((self.path / _META).read_text())
+        self.partitions = meta['partitions']
+        self.columns = meta['columns']
+        # column -> the versions of the inputs it was computed from (see add_column)
+        self.versions = meta.get('versions', {})
+
+    @classmethod
+    def create(cls, path, df, partition_rows=500_000):
+        '''New store with the rows of df (an existing store at path is replaced)'''
+        path = Path(path)
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        (path / _META).write_text(json.dumps({'partitions': [], 'columns': list(df.columns), 'versions': {}}))
+        store = cls(path)
+        store.append(df, partition_rows)
+        return store
+
+    def _save_meta(self):
+        tmp = self.path / (_META + '.tmp')
+        tmp.write_text(json.dumps({'partitions': self.partitions, 'columns': self.columns,
+                                   'versions': self.versions}))
+        os.replace(tmp, self.path / _META)
+
+    def __len__(self):
+        return sum(p['rows'] for p in self.partitions)
+
+    def append(self, df, partition_rows=500_000):
+        '''
+        Add the rows of df as new partitions. df needs every column of the store; columns
+        that the store does not have yet have to go through add_column. The recorded column
+        versions are dropped, they do not cover the new rows.
+        '''
+        missing = set(self.columns) - set(df.columns)
+        extra = set(df.columns) - set(self.columns)
+        if missing or extra:
+            raise ValueError(f"append needs exactly the store columns (missing {sorted(missing)}, extra {sorted(extra)})")
+        # new partitions get the types of the first one, so they concatenate
+        first = self.path / self.partitions[0]['name'] if self.partitions else None
+        types = {c: _column_type(first, c) if first else None for c in self.columns}
+        self.versions = {}
+        for start in range(0, len(df), partition_rows):
+            part = df.iloc[start:start + partition_rows]
+            name = f"part-{len(self.partitions):05d}"
+            (self.path / name).mkdir(exist_ok=True)
+            for column in self.columns:
+                _write_column(self.path / name, column, part[column].to_numpy(), types[column])
+            self.partitions.append({'name': name, 'rows': len(part)})
+            self._save_meta()
+        return self
+
+    def add_column(self, name, values, version=None):
+        '''
+        Write (or overwrite) one column for all rows, in store order. Only that column's files
+        are written. version (anything json can store) is kept in _meta.json as what the column
+        was computed from; without one an earlier version of the column is forgotten.
+        '''
+        values = values.to_numpy() if hasattr(values, 'to_numpy') else pd.Series(values).to_numpy()
+        if len(values) != len(self):
+            raise ValueError(f"{name}: {len(values)} values for {len(self)} rows")
+        # one type for all partitions, a slice that is all None would otherwise get type null
+        type = pa.array(values, from_pandas=True).type
+        start = 0
+        for part in self.partitions:
+            _write_column(self.path / part['name'], name, values[start:start + part['rows']], type)
+            start += part['rows']
+        if name not in self.columns:
+            self.columns.append(name)
+        if version is None:
+            self.versions.pop(name, None)
+        else:
+            self.versions[name] = version
+        self._save_meta()
+        return self
+
+    def add_columns(self, df, version=None):
+        for column in df.columns:
+            self.add_column(column, df[column], version)
+        return self
+
+    def read(self, columns=None, nrows=None):
+        '''
+        The selected columns (default: all) of every partition as one DataFrame; with nrows only
+        the first nrows rows, reading just the partitions they are in.
+        '''
+        columns = list(self.columns if columns is None else columns)
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise KeyError(f"not in the trainset store: {sorted(unknown)}")
+        tables = []
+        rows = 0
+        for p in self.partitions:
+            if nrows is not None and rows >= nrows:
+                break
+            tables.append(pa.table({c: _read_column(self.path / p['name'], c) for c in columns}))
+            rows += p['rows']
+        if not tables:
+            return pd.DataFrame(columns=columns)
+        table = pa.concat_tables(tables)
+        return (table if nrows is None else table.slice(0, nrows)).to_pandas()
+
+    def to_csv(self, path, **kwargs):
+        '''The old flat file, for anything outside this repo that still wants it'''
+        self.read().to_csv(path, index=False, **kwargs)
+
+
+# read_csv arguments read_trainset also applies to a store
+_STORE_KWARGS = {'dtype', 'nrows', 'index_col'}
+
+
+def read_trainset(path=trainset_file, usecols=None, **kwargs):
+    '''
+    Drop-in for pd.read_csv('trainset_reconstructed.csv'): reads the store that belongs to
+    path (see store_path) if it exists, projecting only usecols, else the csv itself.
+    On a store, dtype, nrows and index_col work like in read_csv (usecols come in the file's
+    column order); any other read_csv argument raises a TypeError instead of being ignored.
+    '''
+    store = store_path(path)
+    if not (store / _META).exists():
+        return pd.read_csv(path, usecols=usecols, **kwargs)
+    unsupported = set(kwargs) - _STORE_KWARGS
+    if unsupported:
+        raise TypeError(f"read_trainset on {store.name} does not support {sorted(unsupported)}")
+
+    store = TrainsetStore(store)
+    columns = None if usecols is None else [c for c in store.columns if c in set(usecols)]
+    if usecols is not None and len(columns) < len(set(usecols)):
+        raise ValueError(f"usecols not in the trainset store: {sorted(set(usecols) - set(columns))}")
+    df = store.read(columns, nrows=kwargs.get('nrows'))
+    if kwargs.get('dtype') is not None:
+        df = df.astype(kwargs['dtype'])
+    index_col = kwargs.get('index_col')
+    if index_col is not None and index_col is not False:
+        keys = index_col if isinstance(index_col, (list, tuple)) else [index_col]
+        df = df.set_index([df.columns[k] if isinstance(k, int) else k for k in keys])
+    return df
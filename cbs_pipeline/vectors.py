@@ -0,0 +1,195 @@
+"""
+Precomputed spaCy document vectors for the cleaned children and parents.
+
+The chunked scoring loop ran nlp.pipe on both sides of every pair, so a child in a positive
+and a negative pair was vectorized twice and a popular CBS report thousands of times. Here
+every article's title and content vector is computed once and stored as a float32 matrix
+aligned to the sorted ids, together with the vector norms:
+
+    children_vectors/
+        ids.npy             sorted int64 ids, row i of every matrix belongs to ids[i]
+        title.npy           float32 (n, 300)
+        title_norm.npy      float32 (n,)
+        content.npy, content_norm.npy
+
+Everything is opened memory-mapped, and title_sim_dutch / content_sim_dutch for any list of
+pairs is a gather plus a row-wise dot product (same value as doc.similarity, 0.0 when either
+side has no vector, like the notebook).
+
+versions.json records what the vectors were made from (the cleaner version of every source
+column and the spaCy model), so ensure_vectors only reruns spaCy when one of those changed and
+not every time the cleaned store is rebuilt for, say, a new clean_text_legacy.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from tqdm import tqdm
+
+from cbs_pipeline.cleaning import store_versions
+from cbs_pipeline.lemmatize import model_version
+
+# field -> cleaned column it is computed from
+VECTOR_FIELDS = {
+    'title': 'clean_title_dutch',
+    'content': 'clean_content_dutch',
+}
+
+
+class DocVectors:
+    '''
+    vecs = DocVectors('data/children_vectors')
+    vecs.gather(child_ids, 'title')     # (len(child_ids), 300), zeros for unknown ids
+    '''
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        mode = 'r' if mmap else None
+        self.ids = np.load(self.path / 'ids.npy', mmap_mode=mode)
+        self.fields = [f for f in VECTOR_FIELDS if (self.path / (f + '.npy')).exists()]
+        self.vectors = {f: np.load(self.path / (f + '.npy'), mmap_mode=mode) for f in self.fields}
+        self.norms = {f: np.load(self.path / (f + '_norm.npy'), mmap_mode=mode) for f in self.fields}
+
+    @property
+    def versions(self):
+        '''What the vectors were built from (see vectors_versions), {} for vectors without versions.json'''
+        path = self.path / 'versions.json'
+        return json.loads(path.read_text()) if path.exists() else {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self):
+        return self.vectors[self.fields[0]].shape[1]
+
+    def positions(self, ids):
+        '''Row of every id, -1 for ids without vectors'''
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return np.where(self.ids[idx] == ids, idx, -1)
+
+    def gather(self, ids, field):
+        '''(vectors, norms) for the ids; unknown ids get a zero vector and norm 0'''
+        pos = self.positions(ids)
+        found = pos >= 0
+        vectors = np.zeros((len(pos), self.dim), dtype=np.float32)
+        norms = np.zeros(len(pos), dtype=np.float32)
+        vectors[found] = self.vectors[field][pos[found]]
+        norms[found] = self.norms[field][pos[found]]
+        return vectors, norms
+
+
+def cosine(a, a_norm, b, b_norm):
+    '''Row-wise cosine of two (n, d) matrices given their norms, 0.0 where a norm is 0'''
+    denom = a_norm * b_norm
+    dots = np.einsum('ij,ij->i', a, b)
+    return np.where(denom > 0, dots / np.where(denom > 0, denom, 1), 0.0).astype(np.float32)
+
+
+def pair_similarity(left, right, left_ids, right_ids, field, chunk_size=100_000):
+    '''
+    title_sim_dutch (field='title') or content_sim_dutch (field='content') for every pair
+    left_ids[i] (in the left DocVectors) x right_ids[i] (in the right DocVectors).
+    '''
+    left_ids = np.asarray(left_ids, dtype=np.int64)
+    right_ids = np.asarray(right_ids, dtype=np.int64)
+    out = np.zeros(len(left_ids), dtype=np.float32)
+    for start in range(0, len(left_ids), chunk_size):
+        end = start + chunk_size
+        a, a_norm = left.gather(left_ids[start:end], field)
+        b, b_norm = right.gather(right_ids[start:end], field)
+        out[start:end] = cosine(a, a_norm, b, b_norm)
+    return out
+
+
+def doc_vectors(nlp, texts, batch_size=256, n_process=1):
+    '''
+    (vectors, norms) of the texts. A doc vector is the average of the static word vectors,
+    which only needs the tokenizer, so all pipeline components are switched off.
+    '''
+    vectors = np.zeros((len(texts), nlp.vocab.vectors_length), dtype=np.float32)
+    with nlp.select_pipes(disable=nlp.pipe_names):
+        for i, doc in enumerate(nlp.pipe(texts, batch_size=batch_size, n_process=n_process)):
+            if doc.has_vector:
+                vectors[i] = doc.vector
+    return vectors, np.linalg.norm(vectors, axis=1).astype(np.float32)
+
+
+def vectors_versions(store, nlp, fields=VECTOR_FIELDS):
+    '''
+    {'model': spaCy model, field: cleaner version of its source column}, or None when the store
+    does not carry cleaner versions (then only the modification times can tell).
+    '''
+    versions = store_versions(store)
+    if not all(column in versions for column in fields.values()):
+        return None
+    return dict({'model': model_version(nlp)}, **{field: versions[column] for field, column in fields.items()})
+
+
+def build_vectors(store, output_dir, nlp, fields=VECTOR_FIELDS, chunk_size=10_000, batch_size=256, n_process=1):
+    '''
+    Compute the vectors of every article in a cleaned store (see cleaning.clean_chunked).
+
+    Input:
+        - store: CorpusStore with the clean_*_dutch columns
+        - output_dir: e.g. data/children_vectors (written to a tmp dir first, then swapped in)
+        - fields: field name -> cleaned column
+    Output: DocVectors on the new directory
+    '''
+    output_dir = Path(output_dir)
+    tmp = output_dir.with_name(output_dir.name + '.tmp')
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    ids = np.asarray(store.ids, dtype=np.int64)
+    np.save(tmp / 'ids.npy', ids)
+    dim = nlp.vocab.vectors_length
+    matrices = {f: np.lib.format.open_memmap(tmp / (f + '.npy'), mode='w+', dtype=np.float32, shape=(len(ids), dim))
+                for f in fields}
+    norms = {f: np.zeros(len(ids), dtype=np.float32) for f in fields}
+
+    for start in tqdm(range(0, len(ids), chunk_size)):
+        end = min(start + chunk_size, len(ids))
+        text = store.gather(ids[start:end], list(fields.values()), fill='')
+        for field, column in fields.items():
+            matrices[field][start:end], norms[field][start:end] = doc_vectors(
+                nlp, text[column].astype(str).tolist(), batch_size, n_process)
+    for field in fields:
+        matrices[field].flush()
+        np.save(tmp / (field + '_norm.npy'), norms[field])
+    del matrices
+    versions = vectors_versions(store, nlp, fields)
+    if versions is not None:
+        (tmp / 'versions.json').write_text(json.dumps(versions))
+
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    os.replace(tmp, output_dir)
+    print(f"Success! Saved {len(fields)} x {len(ids)} vectors to {output_dir.name}.")
+    return DocVectors(output_dir)
+
+
+def ensure_vectors(store, output_dir, nlp, **kwargs):
+    '''
+    Open the vectors, (re)building them first when the Dutch cleaning or the spaCy model they
+    were made from changed. Without versions on either side: when the cleaned store is newer.
+    '''
+    output_dir = Path(output_dir)
+    ids_file = output_dir / 'ids.npy'
+    if not ids_file.exists():
+        return build_vectors(store, output_dir, nlp, **kwargs)
+    vecs = DocVectors(output_dir)
+    wanted = vectors_versions(store, nlp, kwargs.get('fields', VECTOR_FIELDS))
+    if wanted is not None and vecs.versions:
+        stale = vecs.versions != wanted or not np.array_equal(vecs.ids, store.ids)
+    else:
+        stale = os.path.getmtime(ids_file) < os.path.getmtime(store.path)
+    if stale:
+        return build_vectors(store, output_dir, nlp, **kwargs)
+    return vecs